@@ -0,0 +1,218 @@
+"""
+Construction et rafraîchissement incrémental de VALFONC_ANALYTICS.GOLD.AGG_MUTATION_MONTHLY
+
+Grain : mois × COMMUNE_ID × CODE_POSTAL_ID × TYPE_LOCAL_ID × mesure (PRIX, SURFACE).
+Chaque ligne porte NB, SOMME, MINI, MAXI, qui se fusionnent par simple somme / min / max,
+et SKETCH, l'histogramme à buckets logarithmiques de la cellule (OBJECT bucket → nombre)
+dont la page Analyse Temporelle tire ses médianes : les histogrammes se fusionnent à la
+lecture (requetes.requete_cube_agrege), au lieu d'une ligne par bucket qui rendrait
+l'agrégat presque aussi gros que la table de faits. Les filtres et les buckets sont ceux
+du cube calculé sur la table de faits (requetes.requete_cube_mensuel).
+
+Rafraîchissement : les mois touchés par les lignes de FACT_MUTATION créées depuis le
+dernier passage (CREATED_AT au-delà du filigrane de AGG_MUTATION_MONTHLY_ETAT) sont
+recalculés entièrement, dans une transaction, puis le filigrane avance. Une suppression
+ou une correction de lignes existantes n'avance pas CREATED_AT : --complet reconstruit
+la table.
+
+    python agregats.py              # incrémental (construction complète au premier passage)
+    python agregats.py --complet    # reconstruction
+"""
+import argparse
+from datetime import datetime
+
+from config_snowflake import get_snowflake_connection, SECRETS_PATH
+from requetes import GAMMA, TABLE_AGREGAT, TABLE_AGREGAT_ETAT
+
+TABLE_FAITS = "VALFONC_ANALYTICS.GOLD.FACT_MUTATION"
+MOIS_A_RECALCULER = "AGG_MUTATION_MONTHLY_MOIS"
+
+def requete_agregat(filtre=""):
+    """SELECT de l'agrégat, limité par `filtre` (condition SQL supplémentaire sur f)"""
+    return f"""
+    WITH base AS (
+        SELECT
+            DATE_TRUNC('month', f.DATE_MUTATION) as MOIS,
+            f.COMMUNE_ID,
+            f.CODE_POSTAL_ID,
+            f.TYPE_LOCAL_ID,
+            f.VALEUR_FONCIERE,
+            f.SURFACE_REELLE_BATI
+        FROM {TABLE_FAITS} f
+        WHERE f.VALEUR_FONCIERE > 0
+            AND f.DATE_MUTATION IS NOT NULL
+            {filtre}
+    ),
+    mesures AS (
+        SELECT
+            b.MOIS,
+            b.COMMUNE_ID,
+            b.CODE_POSTAL_ID,
+            b.TYPE_LOCAL_ID,
+            m.MESURE,
+            CASE WHEN m.MESURE = 'PRIX' THEN b.VALEUR_FONCIERE ELSE b.SURFACE_REELLE_BATI END as VALEUR
+        FROM base b
+        CROSS JOIN (SELECT 'PRIX' as MESURE UNION ALL SELECT 'SURFACE') m
+    ),
+    buckets AS (
+        SELECT
+            MOIS,
+            COMMUNE_ID,
+            CODE_POSTAL_ID,
+            TYPE_LOCAL_ID,
+            MESURE,
+            FLOOR(LN(VALEUR) / LN({GAMMA})) as BUCKET,
+            COUNT(*) as NB,
+            SUM(VALEUR) as SOMME,
+            MIN(VALEUR) as MINI,
+            MAX(VALEUR) as MAXI
+        FROM mesures
+        WHERE VALEUR > 0
+        GROUP BY MOIS, COMMUNE_ID, CODE_POSTAL_ID, TYPE_LOCAL_ID, MESURE, BUCKET
+    )
+    SELECT
+        MOIS,
+        COMMUNE_ID,
+        CODE_POSTAL_ID,
+        TYPE_LOCAL_ID,
+        MESURE,
+        SUM(NB) as NB,
+        SUM(SOMME) as SOMME,
+        MIN(MINI) as MINI,
+        MAX(MAXI) as MAXI,
+        OBJECT_AGG(TO_VARCHAR(BUCKET), TO_VARIANT(NB)) as SKETCH
+    FROM buckets
+    GROUP BY MOIS, COMMUNE_ID, CODE_POSTAL_ID, TYPE_LOCAL_ID, MESURE
+    """
+
+def valeur(cursor, sql, params=None):
+    cursor.execute(sql, params)
+    ligne = cursor.fetchone()
+    return ligne[0] if ligne else None
+
+def table_existe(cursor, nom):
+    """Vrai si la table GOLD `nom` existe"""
+    return valeur(cursor, """
+        SELECT COUNT(*) FROM VALFONC_ANALYTICS.INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA = 'GOLD' AND TABLE_NAME = ?
+    """, [nom.split(".")[-1]]) > 0
+
+def sketch_present(cursor):
+    """Vrai si l'agrégat a la colonne SKETCH (faux pour un agrégat à une ligne par bucket)"""
+    return valeur(cursor, """
+        SELECT COUNT(*) FROM VALFONC_ANALYTICS.INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = 'GOLD' AND TABLE_NAME = ? AND COLUMN_NAME = 'SKETCH'
+    """, [TABLE_AGREGAT.split(".")[-1]]) > 0
+
+def construire(cursor, filigrane):
+    """
+    Reconstruit l'agrégat entier et fixe le filigrane
+
+    La nouvelle table est remplie à côté puis échangée avec l'ancienne (SWAP) : les pages
+    lisent l'ancien agrégat jusqu'à ce que le nouveau soit complet.
+    """
+    nouvelle = f"{TABLE_AGREGAT}_NOUVEAU"
+    cursor.execute(f"""
+        CREATE OR REPLACE TABLE {nouvelle} (
+            MOIS DATE, COMMUNE_ID NUMBER, CODE_POSTAL_ID NUMBER, TYPE_LOCAL_ID NUMBER,
+            MESURE VARCHAR, NB NUMBER, SOMME FLOAT, MINI FLOAT, MAXI FLOAT, SKETCH OBJECT
+        ) CLUSTER BY (MOIS)
+    """)
+    cursor.execute(f"INSERT INTO {nouvelle} {requete_agregat('AND f.CREATED_AT <= ?')}", [filigrane])
+    if table_existe(cursor, TABLE_AGREGAT):
+        cursor.execute(f"ALTER TABLE {TABLE_AGREGAT} SWAP WITH {nouvelle}")
+        cursor.execute(f"DROP TABLE {nouvelle}")
+    else:
+        cursor.execute(f"ALTER TABLE {nouvelle} RENAME TO {TABLE_AGREGAT}")
+    # FILIGRANE prend le type de CREATED_AT (NTZ / TZ) : comparaisons homogènes
+    cursor.execute(f"""
+        CREATE OR REPLACE TABLE {TABLE_AGREGAT_ETAT} AS
+        SELECT CREATED_AT as FILIGRANE, CURRENT_TIMESTAMP() as MAJ FROM {TABLE_FAITS} LIMIT 0
+    """)
+    cursor.execute(f"INSERT INTO {TABLE_AGREGAT_ETAT} SELECT ?, CURRENT_TIMESTAMP()", [filigrane])
+
+def rafraichir(cursor, precedent, filigrane):
+    """
+    Recalcule les mois contenant des lignes créées dans ]precedent, filigrane]
+
+    La liste des mois est figée dans une table temporaire (avant la transaction : un
+    CREATE valide implicitement la transaction en cours), puis suppression, insertion et
+    filigrane sont appliqués ensemble. Retourne le nombre de mois recalculés.
+    """
+    cursor.execute(f"CREATE OR REPLACE TEMPORARY TABLE {MOIS_A_RECALCULER} (MOIS DATE)")
+    cursor.execute(f"""
+        INSERT INTO {MOIS_A_RECALCULER}
+        SELECT DISTINCT DATE_TRUNC('month', DATE_MUTATION)
+        FROM {TABLE_FAITS}
+        WHERE CREATED_AT > ? AND CREATED_AT <= ? AND DATE_MUTATION IS NOT NULL
+    """, [precedent, filigrane])
+    nb_mois = valeur(cursor, f"SELECT COUNT(*) FROM {MOIS_A_RECALCULER}")
+
+    cursor.execute("BEGIN")
+    try:
+        if nb_mois:
+            cursor.execute(f"DELETE FROM {TABLE_AGREGAT} WHERE MOIS IN (SELECT MOIS FROM {MOIS_A_RECALCULER})")
+            cursor.execute(f"""
+                INSERT INTO {TABLE_AGREGAT}
+                {requete_agregat(f"AND DATE_TRUNC('month', f.DATE_MUTATION) IN (SELECT MOIS FROM {MOIS_A_RECALCULER}) AND f.CREATED_AT <= ?")}
+            """, [filigrane])
+        cursor.execute(f"UPDATE {TABLE_AGREGAT_ETAT} SET FILIGRANE = ?, MAJ = CURRENT_TIMESTAMP()", [filigrane])
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return nb_mois
+
+def main():
+    parser = argparse.ArgumentParser(description="Construction / rafraîchissement de AGG_MUTATION_MONTHLY")
+    parser.add_argument(
+        "--complet", action="store_true",
+        help="Reconstruit l'agrégat entier au lieu de recalculer les mois modifiés"
+    )
+    parser.add_argument(
+        "--secrets", default=SECRETS_PATH,
+        help="Fichier secrets.toml contenant la section [snowflake]"
+    )
+    args = parser.parse_args()
+
+    print("🧮 AGRÉGAT MENSUEL AGG_MUTATION_MONTHLY")
+    print("=" * 50)
+
+    conn = get_snowflake_connection(args.secrets)
+    if conn is None:
+        return
+
+    start_time = datetime.now()
+    cursor = conn.cursor()
+    try:
+        # Filigrane figé au départ : les lignes créées pendant le passage iront au suivant
+        filigrane = valeur(cursor, f"SELECT MAX(CREATED_AT) FROM {TABLE_FAITS}")
+        if filigrane is None:
+            print(f"⚠️  {TABLE_FAITS} est vide : rien à agréger")
+            return
+
+        precedent = None
+        if (not args.complet and table_existe(cursor, TABLE_AGREGAT) and table_existe(cursor, TABLE_AGREGAT_ETAT)
+                and sketch_present(cursor)):
+            precedent = valeur(cursor, f"SELECT MAX(FILIGRANE) FROM {TABLE_AGREGAT_ETAT}")
+
+        if precedent is None:
+            print("🔄 Construction complète")
+            construire(cursor, filigrane)
+        elif precedent >= filigrane:
+            print(f"✅ Agrégat déjà à jour (filigrane {precedent})")
+            return
+        else:
+            nb_mois = rafraichir(cursor, precedent, filigrane)
+            print(f"➕ {nb_mois} mois recalculés (lignes créées après {precedent})")
+
+        lignes = valeur(cursor, f"SELECT COUNT(*) FROM {TABLE_AGREGAT}")
+        print(f"📦 {TABLE_AGREGAT} : {lignes:,} lignes, filigrane {filigrane}")
+    finally:
+        cursor.close()
+        conn.close()
+
+    print(f"✅ Terminé en {(datetime.now() - start_time).total_seconds():.1f} s")
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,57 @@
+from contextlib import contextmanager
+
 import streamlit as st
 import snowflake.snowpark as snowpark
 
+from db import get_snowflake_connection, PoolConnexions
+from warmup import demarrer_prechauffage
+
 st.title("🏠 Prédiction Prix Immobilier - Rennes")
 
-# Connexion Snowflake
+# Connexion Snowflake : les sessions Snowpark enveloppent des connexions du pool partagé,
+# empruntées le temps d'une prédiction comme pour les requêtes des pages
 @st.cache_resource
 def init_snowflake():
-    return snowpark.Session.builder.configs({
-        "account": st.secrets["snowflake"]["account"],
-        "user": st.secrets["snowflake"]["user"],
-        "password": st.secrets["snowflake"]["password"],
-        "warehouse": st.secrets["snowflake"]["warehouse"],
-        "database": "VALFONC_ANALYTICS",
-        "schema": "GOLD"
-    }).create()
+    pool = get_snowflake_connection()
+    if pool is None:
+        return None
+    if not isinstance(pool, PoolConnexions):
+        # Source locale : les UDF de prédiction n'existent que dans Snowflake
+        st.error("La prédiction nécessite Snowflake (section [donnees] de secrets.toml)")
+        return None
+    return pool
+
+@st.cache_resource
+def sessions_snowpark():
+    """Session Snowpark de chaque connexion du pool, créée à son premier emprunt"""
+    return {}
+
+@contextmanager
+def session_snowpark(pool):
+    """
+    Session Snowpark sur une connexion empruntée au pool, rendue à la sortie du bloc
 
-session = init_snowflake()
+    La session n'ouvre pas de connexion à elle. Elle n'est pas fermée (elle fermerait la
+    connexion du pool) mais réutilisée au prochain emprunt de la même connexion.
+    """
+    sessions = sessions_snowpark()
+    with pool.connexion() as conn:
+        # Connexions fermées et remplacées par le pool : leur session est abandonnée
+        for ancienne, _ in list(sessions.items()):
+            if ancienne.is_closed():
+                sessions.pop(ancienne, None)
+        session = sessions.get(conn)
+        if session is None:
+            session = snowpark.Session.builder.configs({"connection": conn}).create()
+            sessions[conn] = session
+        yield session
+
+pool = init_snowflake()
+if pool is None:
+    st.stop()
+
+# Préchauffage du cache des pages (une fois par processus, en arrière-plan)
+demarrer_prechauffage()
 
 # Interface
 col1, col2 = st.columns(2)
@@ -29,17 +65,21 @@ with col2:
     postal = st.selectbox("Code postal", ["35000", "35200", "35700"])
 
 if st.button("🔮 Prédire le prix"):
-    # Prédiction
-    result = session.sql(f"""
-        SELECT PREDICT_PROPERTY_PRICE({surface}, {pieces}, {distance}, '{postal}') as prix
-    """).collect()[0]['PRIX']
-
-    st.success(f"**Prix estimé : {result:,.0f} €**")
-
-    # Biens similaires
-    st.subheader("🏘️ Biens similaires")
-    similar = session.sql(f"""
-        SELECT * FROM TABLE(FIND_SIMILAR_PROPERTIES({surface}, {pieces}, '{postal}'))
-    """).to_pandas()
+    # Noms qualifiés : la connexion empruntée garde le contexte de la section [snowflake]
+    with session_snowpark(pool) as session:
+        # Prédiction
+        result = session.sql(
+            "SELECT VALFONC_ANALYTICS.GOLD.PREDICT_PROPERTY_PRICE(?, ?, ?, ?) as prix",
+            params=[surface, pieces, distance, postal]
+        ).collect()[0]['PRIX']
+
+        st.success(f"**Prix estimé : {result:,.0f} €**")
+
+        # Biens similaires
+        st.subheader("🏘️ Biens similaires")
+        similar = session.sql(
+            "SELECT * FROM TABLE(VALFONC_ANALYTICS.GOLD.FIND_SIMILAR_PROPERTIES(?, ?, ?))",
+            params=[surface, pieces, postal]
+        ).to_pandas()
 
     st.dataframe(similar)
@@ -0,0 +1,213 @@
+"""
+Benchmark hors ligne de elt.py
+
+Génère des fichiers adresses-XX.csv.gz synthétiques, les sert depuis un serveur HTTP
+local et remplace write_pandas / la connexion Snowflake par un puits local. Chaque mode
+de chargement est exécuté dans un processus séparé (pic de mémoire indépendant) et
+mesuré : lignes/s, Mo/s, pic de RSS (processus principal et processus de parsing,
+voir elt.pic_memoire_run) et temps cumulé par étape.
+
+    python bench_elt.py
+    python bench_elt.py --lignes 500000 --departements 6 --modes flux pipeline
+    python bench_elt.py --moteur copy --sortie bench_output.txt
+"""
+import argparse
+import functools
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+# Modes comparés : paramètres passés à charger_departements ou charger_pipeline
+MODES = {
+    "sequentiel": {"workers": 1},
+    "threads": {"workers": 4},
+    "flux": {"workers": 1, "stream": True, "chunksize": 100_000},
+    "pipeline": {"pipeline": True, "telechargeurs": 2, "chargeurs": 2},
+}
+
+ETAPES = ["telechargement", "decompression", "parsing", "chargement"]
+
+COMMUNES = [
+    ("35000", "35238", "Rennes"), ("44000", "44109", "Nantes"), ("75011", "75111", "Paris"),
+    ("13001", "13201", "Marseille"), ("59000", "59350", "Lille"), ("69003", "69383", "Lyon"),
+]
+
+def generer_csv(chemin, lignes, graine=0):
+    """Écrit un adresses-XX.csv.gz synthétique au format BAN"""
+    rng = np.random.default_rng(graine)
+    communes = np.array(COMMUNES)[rng.integers(0, len(COMMUNES), lignes)]
+    index = np.arange(lignes)
+    df = pd.DataFrame({
+        "id": [f"{c}_{i:05d}_00001" for c, i in zip(communes[:, 1], index)],
+        "id_fantoir": "",
+        "numero": rng.integers(1, 400, lignes),
+        "rep": np.where(rng.random(lignes) < 0.05, "bis", ""),
+        "nom_voie": [f"Rue {i % 5000}" for i in index],
+        "code_postal": communes[:, 0],
+        "code_insee": communes[:, 1],
+        "nom_commune": communes[:, 2],
+        "code_insee_ancienne_commune": "",
+        "nom_ancienne_commune": "",
+        "x": rng.uniform(100_000, 1_200_000, lignes).round(2),
+        "y": rng.uniform(6_000_000, 7_100_000, lignes).round(2),
+        "lon": rng.uniform(-5, 9, lignes).round(5),
+        "lat": rng.uniform(41, 51, lignes).round(5),
+        "type_position": "entrée",
+        "alias": "",
+        "nom_ld": "",
+        "libelle_acheminement": np.char.upper(communes[:, 2]),
+        "nom_afnor": [f"RUE {i % 5000}" for i in index],
+        "source_position": np.where(rng.random(lignes) < 0.5, "commune", "arcep"),
+        "source_nom_voie": "commune",
+        "certification_commune": rng.integers(0, 2, lignes),
+        "cad_parcelles": "",
+    })
+    df.to_csv(chemin, sep=";", index=False, compression="gzip")
+
+def demarrer_serveur(dossier):
+    """Sert `dossier` en HTTP sur un port libre et retourne l'URL modèle de elt.BAN_URL"""
+    class Handler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    serveur = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(Handler, directory=dossier))
+    threading.Thread(target=serveur.serve_forever, daemon=True).start()
+    return serveur, f"http://127.0.0.1:{serveur.server_address[1]}/adresses-{{dept}}.csv.gz"
+
+class ConnexionLocale:
+    """Connexion factice : les requêtes SQL (PUT, DELETE...) sont ignorées"""
+
+    description = ()
+
+    def cursor(self):
+        return self
+
+    def execute(self, *args, **kwargs):
+        return self
+
+    def close(self):
+        pass
+
+def puits_local(conn, df, **kwargs):
+    """Remplace write_pandas : sérialise le DataFrame en Parquet en mémoire, comme le connecteur"""
+    df.to_parquet(io.BytesIO(), compression="snappy", index=False)
+    return True, 1, len(df), None
+
+def executer_mode(mode, url, departements, moteur):
+    """Exécute un mode de chargement dans le processus courant et retourne ses mesures"""
+    import elt
+
+    elt.BAN_URL = url
+    elt.write_pandas = puits_local
+    elt.get_snowflake_connection = ConnexionLocale
+    elt.STAGING_DIR = tempfile.mkdtemp(prefix="bench_parquet_")
+    elt.REJETS_DIR = tempfile.mkdtemp(prefix="bench_rejets_")
+
+    if moteur == "parquet":
+        sink = elt.creer_sink("parquet", dossier=tempfile.mkdtemp(prefix="bench_local_"))
+    else:
+        sink = elt.creer_sink("snowflake", moteur=moteur)
+
+    options = dict(MODES[mode])
+    debut = time.perf_counter()
+    if options.pop("pipeline", False):
+        resultats = elt.charger_pipeline(departements, sink, **options)
+    else:
+        resultats = elt.charger_departements(departements, sink, **options)
+    duree = time.perf_counter() - debut
+
+    return {
+        "mode": mode,
+        "moteur": moteur,
+        "duree": duree,
+        "echecs": sum(not r["succes"] for r in resultats.values()),
+        "lignes": sum(r["lignes"] for r in resultats.values()),
+        "octets_telecharges": sum(r["octets_telecharges"] for r in resultats.values()),
+        "octets_decompresses": sum(r["octets_decompresses"] for r in resultats.values()),
+        "pic_rss_mo": elt.pic_memoire_run(resultats),
+        "etapes": {
+            etape: sum(r["durees"].get(etape, 0.0) for r in resultats.values())
+            for etape in ETAPES
+        },
+    }
+
+def afficher(mesures):
+    """Affiche le tableau comparatif des modes"""
+    entete = f"{'mode':<12}{'durée s':>9}{'lignes/s':>12}{'Mo/s':>8}{'pic RSS Mo':>12}"
+    entete += "".join(f"{etape:>16}" for etape in ETAPES)
+    print("\n" + entete)
+    print("-" * len(entete))
+    for m in mesures:
+        duree = max(m["duree"], 1e-9)
+        pic = f"{m['pic_rss_mo']:,.0f}" if m["pic_rss_mo"] is not None else "n/a"
+        ligne = f"{m['mode']:<12}{m['duree']:>9.2f}{m['lignes'] / duree:>12,.0f}"
+        ligne += f"{m['octets_decompresses'] / 1e6 / duree:>8.1f}{pic:>12}"
+        ligne += "".join(f"{m['etapes'][etape]:>16.2f}" for etape in ETAPES)
+        if m["echecs"]:
+            ligne += f"  ({m['echecs']} échecs)"
+        print(ligne)
+    print("\nMo/s : CSV décompressé traité par seconde ; étapes : temps cumulé sur tous les départements (s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne des modes de chargement de elt.py")
+    parser.add_argument("--lignes", type=int, default=200_000, help="Lignes par département synthétique")
+    parser.add_argument("--departements", type=int, default=4, help="Nombre de départements synthétiques")
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=list(MODES))
+    parser.add_argument(
+        "--moteur", choices=["write_pandas", "copy", "parquet"], default="write_pandas",
+        help="write_pandas / copy : sink Snowflake branché sur un puits local ; parquet : sink Parquet local"
+    )
+    parser.add_argument("--sortie", help="Fichier JSON-lines où ajouter les mesures")
+    # Usage interne : exécution d'un mode dans un sous-processus
+    parser.add_argument("--executer", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--liste", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.executer:
+        with open(os.devnull, "w") as silence:
+            sortie, sys.stdout = sys.stdout, silence
+            try:
+                mesure = executer_mode(args.executer, args.url, args.liste, args.moteur)
+            finally:
+                sys.stdout = sortie
+        print(json.dumps(mesure))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="bench_ban_") as dossier:
+        departements = [f"{i + 1:02d}" for i in range(args.departements)]
+        print(f"🧪 Génération de {len(departements)} départements × {args.lignes:,} lignes...")
+        for i, dept in enumerate(departements):
+            generer_csv(os.path.join(dossier, f"adresses-{dept}.csv.gz"), args.lignes, graine=i)
+
+        serveur, url = demarrer_serveur(dossier)
+        mesures = []
+        try:
+            for mode in args.modes:
+                print(f"⏱️  Mode {mode}...")
+                sortie = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--executer", mode, "--url", url,
+                     "--moteur", args.moteur, "--liste", *departements],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                mesures.append(json.loads(sortie.strip().splitlines()[-1]))
+        finally:
+            serveur.shutdown()
+
+    afficher(mesures)
+    if args.sortie:
+        with open(args.sortie, "a", encoding="utf-8") as f:
+            for m in mesures:
+                f.write(json.dumps(m) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Cache des résultats de requêtes (tables Arrow), indexé par la clé normalisée de db.cle_requete
+
+Deux backends interchangeables, choisis dans la section [cache] de secrets.toml :
+
+- "memoire" : LRU dans le processus Streamlit (comportement historique de st.cache_data) ;
+- "disque" : fichiers Arrow IPC dans un dossier partagé, relus en mémoire mappée. Plusieurs
+  réplicas pointant sur le même dossier (volume partagé) et les redémarrages profitent
+  des mêmes résultats.
+
+Chaque entrée expire après son TTL ; au-delà de la taille maximale, les entrées les
+moins récemment lues sont évincées.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import pyarrow as pa
+
+# Métadonnée de schéma portant l'échéance (epoch) d'une entrée du cache disque
+_EXPIRATION = b"cache_expire_a"
+
+class CacheMemoire:
+    """LRU en mémoire du processus, borné en octets (taille des tables Arrow)"""
+
+    def __init__(self, taille_max_mo=256, ttl=600):
+        self.taille_max = taille_max_mo * 1024 * 1024
+        self.ttl = ttl
+        self.verrou = threading.Lock()
+        self.entrees = OrderedDict()
+        self.taille = 0
+
+    def lire(self, cle):
+        """Table en cache pour `cle`, ou None si absente ou expirée"""
+        with self.verrou:
+            entree = self.entrees.get(cle)
+            if entree is None:
+                return None
+            table, expire_a = entree
+            if expire_a <= time.time():
+                self._retirer(cle)
+                return None
+            self.entrees.move_to_end(cle)
+            return table
+
+    def ecrire(self, cle, table, ttl=None):
+        with self.verrou:
+            if cle in self.entrees:
+                self._retirer(cle)
+            self.entrees[cle] = (table, time.time() + (ttl or self.ttl))
+            self.taille += table.nbytes
+            while self.taille > self.taille_max and len(self.entrees) > 1:
+                self._retirer(next(iter(self.entrees)))
+
+    def _retirer(self, cle):
+        table, _ = self.entrees.pop(cle)
+        self.taille -= table.nbytes
+
+class CacheDisque:
+    """
+    Fichiers Arrow IPC `<dossier>/<cle[:2]>/<cle>.arrow`, partageables entre processus
+
+    L'échéance est écrite dans les métadonnées du schéma ; la date de modification du
+    fichier sert d'horodatage LRU (mise à jour à chaque lecture). Les écritures passent
+    par un fichier temporaire renommé, un lecteur ne voit jamais un fichier partiel.
+    """
+
+    def __init__(self, dossier=".cache/requetes", taille_max_mo=1024, ttl=600):
+        self.dossier = dossier
+        self.taille_max = taille_max_mo * 1024 * 1024
+        self.ttl = ttl
+        os.makedirs(dossier, exist_ok=True)
+
+    def _chemin(self, cle):
+        return os.path.join(self.dossier, cle[:2], f"{cle}.arrow")
+
+    def lire(self, cle):
+        """Table en cache pour `cle`, ou None si absente ou expirée"""
+        chemin = self._chemin(cle)
+        try:
+            with pa.memory_map(chemin) as source:
+                table = pa.ipc.open_file(source).read_all()
+            os.utime(chemin)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+
+        metadonnees = table.schema.metadata or {}
+        if float(metadonnees.get(_EXPIRATION, 0)) <= time.time():
+            self._supprimer(chemin)
+            return None
+        return table.replace_schema_metadata(
+            {k: v for k, v in metadonnees.items() if k != _EXPIRATION} or None
+        )
+
+    def ecrire(self, cle, table, ttl=None):
+        chemin = self._chemin(cle)
+        os.makedirs(os.path.dirname(chemin), exist_ok=True)
+        metadonnees = dict(table.schema.metadata or {})
+        metadonnees[_EXPIRATION] = str(time.time() + (ttl or self.ttl)).encode()
+        table = table.replace_schema_metadata(metadonnees)
+
+        tmp = f"{chemin}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, chemin)
+        self._evincer()
+
+    def _evincer(self):
+        """Supprime les entrées les moins récemment lues tant que le dossier dépasse la taille maximale"""
+        fichiers = []
+        for racine, _, noms in os.walk(self.dossier):
+            for nom in noms:
+                if nom.endswith(".arrow"):
+                    chemin = os.path.join(racine, nom)
+                    try:
+                        stat = os.stat(chemin)
+                    except FileNotFoundError:
+                        continue
+                    fichiers.append((stat.st_mtime, stat.st_size, chemin))
+
+        taille = sum(f[1] for f in fichiers)
+        for _, octets, chemin in sorted(fichiers):
+            if taille <= self.taille_max:
+                break
+            self._supprimer(chemin)
+            taille -= octets
+
+    @staticmethod
+    def _supprimer(chemin):
+        try:
+            os.remove(chemin)
+        except FileNotFoundError:
+            pass
+
+def creer_cache(backend="memoire", **options):
+    """Construit le backend de cache décrit par la section [cache] de secrets.toml"""
+    if backend == "disque":
+        return CacheDisque(**options)
+    if backend == "memoire":
+        return CacheMemoire(**{k: v for k, v in options.items() if k != "dossier"})
+    raise ValueError(f"Backend de cache inconnu : {backend}")
@@ -0,0 +1,31 @@
+"""
+Connexion Snowflake des scripts en ligne de commande (export_instantane.py, agregats.py)
+
+Les identifiants sont lus dans la section [snowflake] de secrets.toml, comme pour
+l'application Streamlit, mais sans dépendre de Streamlit.
+"""
+import tomllib
+
+import snowflake.connector
+
+SECRETS_PATH = ".streamlit/secrets.toml"
+
+def get_snowflake_connection(chemin=SECRETS_PATH):
+    """Connexion Snowflake avec les identifiants de la section [snowflake] de secrets.toml"""
+    try:
+        with open(chemin, "rb") as f:
+            config = tomllib.load(f)["snowflake"]
+        conn = snowflake.connector.connect(
+            user=config["user"],
+            password=config["password"],
+            account=config["account"],
+            warehouse=config["warehouse"],
+            database="VALFONC_ANALYTICS",
+            schema="GOLD",
+            paramstyle="qmark"
+        )
+        print("✅ Connexion Snowflake établie")
+        return conn
+    except Exception as e:
+        print(f"❌ Erreur de connexion à Snowflake: {e}")
+        return None
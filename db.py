@@ -0,0 +1,628 @@
+"""
+Accès Snowflake partagé par les pages Streamlit
+
+Les connexions viennent d'un pool borné partagé par toutes les pages et sessions
+(PoolConnexions) : chaque requête emprunte une connexion le temps de son exécution. Une
+source locale (instantané Parquet lu par DuckDB, source_locale.py) peut remplacer
+Snowflake sans modifier les requêtes.
+
+Les requêtes sont écrites avec des paramètres liés (?) plutôt qu'en f-string : le texte
+SQL ne dépend plus des filtres, ce qui permet à Snowflake de réutiliser plans et cache
+de résultats, et ferme la porte aux injections. run_query met les résultats en cache
+sous une clé normalisée (texte SQL canonique + paramètres), partagée par toutes les
+requêtes sémantiquement identiques quelle que soit leur mise en forme, et complétée par
+la version des données gold (SondeVersion) : un chargement invalide le cache. Le stockage est
+délégué à un backend de cache_requetes (mémoire du processus, ou disque partagé entre
+réplicas et redémarrages) choisi dans la section [cache] de secrets.toml.
+
+Les résultats sont lus au format Arrow (fetch_arrow_all), les colonnes DECIMAL converties
+une seule fois en entiers ou flottants, et mis en cache sous cette forme compacte.
+"""
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import snowflake.connector
+import streamlit as st
+
+from cache_requetes import creer_cache
+from source_locale import SourceLocale
+
+# Lu de gauche à droite : littéraux et identifiants entre guillemets (conservés), ou suite
+# de blancs et de commentaires (remplacée par un espace)
+_JETONS = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|(?:\s|--[^\n]*|/\*.*?\*/)+""", re.DOTALL)
+
+# Couche dont la version (dernière modification de ses tables) entre dans les clés de cache
+BASE_VERSIONNEE = "VALFONC_ANALYTICS"
+SCHEMA_VERSIONNE = "GOLD"
+# Intervalle minimal (secondes) entre deux sondages de la version
+INTERVALLE_VERSION = 60
+# Durée de vie par défaut d'un résultat : la clé change dès que les données changent,
+# le TTL ne borne plus que les modifications invisibles de la sonde
+TTL_DEFAUT = 6 * 3600
+
+# Pool de connexions (section [pool] de secrets.toml)
+TAILLE_POOL = 4
+INACTIVITE_MAX = 1800
+VERIFICATION_APRES = 120
+ATTENTE_EMPRUNT = 30
+
+# Profilage : journal JSONL des requêtes (section [profilage] de secrets.toml) et
+# derniers profils gardés en mémoire pour le processus et pour chaque session
+JOURNAL_PROFIL = "requetes_profil.jsonl"
+PROFILS_PROCESSUS = 500
+PROFILS_SESSION = 100
+
+# Requêtes exécutées en arrière-plan (calculs exacts derrière un aperçu) simultanément par
+# processus : les autres connexions du pool restent aux requêtes interactives
+REQUETES_ARRIERE_PLAN = 2
+
+# Bornes d'un int64, cible des colonnes DECIMAL entières
+INT64_MIN, INT64_MAX = -2**63, 2**63 - 1
+
+def ouvrir_connexion():
+    """Ouvre une connexion Snowflake (paramètres liés au format ?, session maintenue active)"""
+    return snowflake.connector.connect(
+        user=st.secrets["snowflake"]["user"],
+        password=st.secrets["snowflake"]["password"],
+        account=st.secrets["snowflake"]["account"],
+        warehouse=st.secrets["snowflake"]["warehouse"],
+        database=st.secrets["snowflake"]["database"],
+        schema=st.secrets["snowflake"]["schema"],
+        paramstyle="qmark",
+        client_session_keep_alive=True
+    )
+
+class PoolConnexions:
+    """
+    Pool borné de connexions Snowflake partagé par toutes les pages et sessions
+
+    Une connexion est empruntée le temps d'une requête (connexion(pool)) puis rendue :
+    les sessions concurrentes s'exécutent en parallèle jusqu'à `taille` connexions, au-delà
+    elles attendent une connexion libre (TimeoutError après `attente_max` secondes).
+
+    Les connexions rendues sont réutilisées de la plus récente à la plus ancienne. Une
+    connexion inactive depuis plus de `verification_apres` secondes est vérifiée (SELECT 1)
+    avant d'être prêtée, une connexion inactive depuis plus de `inactivite_max` secondes
+    est fermée et remplacée.
+    """
+
+    def __init__(self, ouvrir, taille=TAILLE_POOL, inactivite_max=INACTIVITE_MAX,
+                 verification_apres=VERIFICATION_APRES, attente_max=ATTENTE_EMPRUNT):
+        self.ouvrir = ouvrir
+        self.inactivite_max = inactivite_max
+        self.verification_apres = verification_apres
+        self.attente_max = attente_max
+        self.places = threading.BoundedSemaphore(taille)
+        self.verrou = threading.Lock()
+        # (connexion, rendue_a), la plus récemment rendue en dernier
+        self.libres = []
+
+    def emprunter(self):
+        """Connexion libre et saine, ou nouvelle connexion ; à rendre avec rendre()"""
+        if not self.places.acquire(timeout=self.attente_max):
+            raise TimeoutError(f"Aucune connexion Snowflake libre après {self.attente_max} s")
+        try:
+            while True:
+                with self.verrou:
+                    if not self.libres:
+                        break
+                    conn, rendue_a = self.libres.pop()
+                if self._saine(conn, time.monotonic() - rendue_a):
+                    return conn
+                self._fermer(conn)
+            return self.ouvrir()
+        except BaseException:
+            self.places.release()
+            raise
+
+    def rendre(self, conn):
+        """Remet une connexion empruntée dans le pool (fermée par Snowflake : abandonnée)"""
+        try:
+            if not conn.is_closed():
+                with self.verrou:
+                    self.libres.append((conn, time.monotonic()))
+            self._elaguer()
+        finally:
+            self.places.release()
+
+    @contextmanager
+    def connexion(self):
+        conn = self.emprunter()
+        try:
+            yield conn
+        finally:
+            self.rendre(conn)
+
+    def fermer(self):
+        """Ferme les connexions libres"""
+        with self.verrou:
+            libres, self.libres = self.libres, []
+        for conn, _ in libres:
+            self._fermer(conn)
+
+    def _saine(self, conn, inactivite):
+        if inactivite > self.inactivite_max or conn.is_closed():
+            return False
+        if inactivite < self.verification_apres:
+            return True
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _elaguer(self):
+        """Ferme les connexions libres inactives depuis plus de inactivite_max"""
+        limite = time.monotonic() - self.inactivite_max
+        with self.verrou:
+            perimees = [c for c, rendue_a in self.libres if rendue_a < limite]
+            self.libres = [(c, r) for c, r in self.libres if r >= limite]
+        for conn in perimees:
+            self._fermer(conn)
+
+    @staticmethod
+    def _fermer(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+@st.cache_resource
+def get_snowflake_connection():
+    """
+    Source des requêtes du processus, selon la section [donnees] de secrets.toml
+
+    - backend = "snowflake" (défaut) : pool de connexions Snowflake (section [pool]) ;
+    - backend = "local" : instantané Parquet de la couche gold lu par DuckDB (SourceLocale).
+
+    Une première connexion est ouverte pour valider la configuration : None si elle échoue.
+    """
+    donnees = st.secrets.get("donnees", {})
+    if donnees.get("backend", "snowflake") == "local":
+        try:
+            return SourceLocale(donnees.get("dossier", "instantane"))
+        except Exception as e:
+            st.error(f"Erreur d'ouverture de l'instantané local: {e}")
+            return None
+
+    config = st.secrets.get("pool", {})
+    try:
+        pool = PoolConnexions(
+            ouvrir_connexion,
+            taille=config.get("taille", TAILLE_POOL),
+            inactivite_max=config.get("inactivite_max", INACTIVITE_MAX),
+            verification_apres=config.get("verification_apres", VERIFICATION_APRES),
+            attente_max=config.get("attente_max", ATTENTE_EMPRUNT),
+        )
+        pool.rendre(pool.emprunter())
+        return pool
+    except Exception as e:
+        st.error(f"Erreur de connexion à Snowflake: {e}")
+        return None
+
+@contextmanager
+def connexion(source):
+    """Connexion utilisable le temps du bloc : empruntée si `source` est un pool ou la source locale, `source` elle-même sinon"""
+    if isinstance(source, (PoolConnexions, SourceLocale)):
+        with source.connexion() as conn:
+            yield conn
+    else:
+        yield source
+
+def normaliser_sql(sql):
+    """Texte SQL canonique : sans commentaires, blancs réduits à un espace hors littéraux, sans ; final"""
+    sql = _JETONS.sub(lambda m: m.group() if m.group()[0] in "'\"" else " ", sql)
+    return sql.strip().rstrip(";").strip()
+
+def normaliser_params(params):
+    """Paramètres liés sous forme canonique : tuple de valeurs Python, dates en ISO 8601"""
+    valeurs = []
+    for valeur in params or ():
+        if hasattr(valeur, "item"):
+            # Scalaires NumPy / pandas
+            valeur = valeur.item()
+        if isinstance(valeur, (date, datetime)):
+            valeur = valeur.isoformat()
+        valeurs.append(valeur)
+    return tuple(valeurs)
+
+def cle_requete(sql, params=None, version=None):
+    """Clé de cache stable d'une requête : empreinte du SQL normalisé, de ses paramètres et de la version des données"""
+    contenu = json.dumps([normaliser_sql(sql), normaliser_params(params), version], default=str)
+    return hashlib.sha256(contenu.encode("utf-8")).hexdigest()
+
+def filtres_sql(*conditions):
+    """
+    Assemble des conditions (sql, valeur) en clause " AND ..." avec paramètres liés
+
+    Les conditions dont la valeur est None ou vide sont ignorées, dans un ordre fixe :
+    deux appels équivalents produisent le même texte SQL. Retourne (sql, params).
+    """
+    sql, params = "", []
+    for condition, valeur in conditions:
+        if valeur is None or valeur == "":
+            continue
+        sql += f" AND {condition}"
+        params.append(valeur)
+    return sql, params
+
+def tient_en_int64(colonne):
+    """Vrai si toutes les valeurs d'une colonne DECIMAL d'échelle nulle tiennent dans un int64"""
+    if colonne.type.precision <= 18:
+        return True
+    bornes = pc.min_max(colonne)
+    if not bornes["min"].is_valid:
+        return True
+    return INT64_MIN <= bornes["min"].as_py() and bornes["max"].as_py() <= INT64_MAX
+
+def typer_arrow(table):
+    """
+    Convertit les colonnes DECIMAL d'un résultat : int64 si l'échelle est nulle et que les
+    valeurs y tiennent (NUMBER(38,0) des identifiants et comptages compris), float64 sinon
+    """
+    for i, champ in enumerate(table.schema):
+        if pa.types.is_decimal(champ.type):
+            colonne = table.column(i)
+            entier = champ.type.scale == 0 and tient_en_int64(colonne)
+            table = table.set_column(i, champ.name, colonne.cast(pa.int64() if entier else pa.float64()))
+    return table
+
+def lire_arrow(cursor):
+    """Résultat d'un curseur exécuté, en table Arrow typée (vide mais avec ses colonnes si aucune ligne)"""
+    table = cursor.fetch_arrow_all()
+    if table is None:
+        return pa.table({col[0]: pa.array([], pa.null()) for col in cursor.description})
+    return typer_arrow(table)
+
+def vers_pandas(table):
+    """Table Arrow → DataFrame (dates en datetime64)"""
+    return table.to_pandas(date_as_object=False)
+
+def executer_arrow(conn, sql, params=None, profil=None):
+    """
+    Exécute une requête sans cache et retourne une table Arrow (les erreurs sont levées)
+
+    Si `profil` est fourni, y renseigne sfqid, duree_execution et duree_lecture.
+    """
+    with connexion(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            debut = time.perf_counter()
+            try:
+                cursor.execute(normaliser_sql(sql), normaliser_params(params) or None)
+            finally:
+                if profil is not None:
+                    profil["sfqid"] = cursor.sfqid
+            lecture = time.perf_counter()
+            table = lire_arrow(cursor)
+            if profil is not None:
+                profil["duree_execution"] = round(lecture - debut, 4)
+                profil["duree_lecture"] = round(time.perf_counter() - lecture, 4)
+            return table
+        finally:
+            cursor.close()
+
+def executer(conn, sql, params=None):
+    """Exécute une requête sans cache et retourne un DataFrame (les erreurs sont levées, l'exécution est profilée)"""
+    with profiler(sql, params, "snowflake") as profil:
+        table = executer_arrow(conn, sql, params, profil)
+        profil.update(lignes=table.num_rows, octets=table.nbytes)
+    return vers_pandas(table)
+
+def nouveau_profil(sql, params, source=None):
+    """
+    Profil d'une requête, complété au fil de son exécution puis passé à enregistrer_profil
+
+    Champs : horodatage, sql (normalisé), params, source ("cache" ou "snowflake"), sfqid,
+    durée totale, durées d'exécution et de lecture du résultat, lignes, octets (taille
+    Arrow du résultat), erreur éventuelle.
+    """
+    return {
+        "horodatage": datetime.now().isoformat(timespec="milliseconds"),
+        "sql": normaliser_sql(sql),
+        "params": list(normaliser_params(params)),
+        "source": source,
+        "sfqid": None,
+        "duree": None,
+        "duree_execution": None,
+        "duree_lecture": None,
+        "lignes": None,
+        "octets": None,
+        "erreur": None,
+    }
+
+@contextmanager
+def profiler(sql, params, source=None):
+    """Mesure le bloc et enregistre le profil (complété par le bloc) à sa sortie, même en erreur"""
+    profil = nouveau_profil(sql, params, source)
+    debut = time.perf_counter()
+    try:
+        yield profil
+    except Exception as e:
+        profil["erreur"] = str(e)
+        raise
+    finally:
+        profil["duree"] = round(time.perf_counter() - debut, 4)
+        enregistrer_profil(profil)
+
+_profils = deque(maxlen=PROFILS_PROCESSUS)
+_verrou_profils = threading.Lock()
+
+@st.cache_resource
+def get_journal_profil():
+    """Chemin du journal JSONL des requêtes ([profilage] journal, vide pour le désactiver)"""
+    return st.secrets.get("profilage", {}).get("journal", JOURNAL_PROFIL) or None
+
+def enregistrer_profil(profil):
+    """Ajoute un profil aux derniers profils du processus, à ceux de la session et au journal"""
+    journal = get_journal_profil()
+    with _verrou_profils:
+        _profils.append(profil)
+        if journal:
+            with open(journal, "a", encoding="utf-8") as f:
+                f.write(json.dumps(profil, ensure_ascii=False, default=str) + "\n")
+    try:
+        if "profil_requetes" not in st.session_state:
+            st.session_state["profil_requetes"] = deque(maxlen=PROFILS_SESSION)
+        st.session_state["profil_requetes"].append(profil)
+    except Exception:
+        # Hors d'une session Streamlit (thread de préchauffage)
+        pass
+
+def profils_processus():
+    """Derniers profils de toutes les sessions du processus (et du préchauffage)"""
+    with _verrou_profils:
+        return list(_profils)
+
+class SondeVersion:
+    """
+    Version des données de la couche gold, sondée au plus une fois par intervalle
+
+    La version est la date de dernière modification (LAST_ALTERED) la plus récente des
+    tables du schéma : elle change à chaque chargement, et avec elle les clés de cache,
+    si bien que les résultats restent valides jusqu'au prochain chargement effectif.
+    Si la sonde échoue, la dernière version connue est conservée. Pour la source locale,
+    la version est la date de modification de l'instantané.
+    """
+
+    def __init__(self, intervalle=INTERVALLE_VERSION):
+        self.intervalle = intervalle
+        self.verrou = threading.Lock()
+        self.version = None
+        self.sonde_a = 0.0
+
+    def lire(self, conn):
+        with self.verrou:
+            if time.monotonic() - self.sonde_a < self.intervalle:
+                return self.version
+            self.sonde_a = time.monotonic()
+            if isinstance(conn, SourceLocale):
+                self.version = conn.version()
+                return self.version
+            try:
+                table = executer_arrow(conn, f"""
+                    SELECT MAX(LAST_ALTERED) FROM {BASE_VERSIONNEE}.INFORMATION_SCHEMA.TABLES
+                    WHERE TABLE_SCHEMA = ? AND TABLE_TYPE = 'BASE TABLE'
+                """, [SCHEMA_VERSIONNE])
+                version = table.column(0)[0].as_py()
+                self.version = None if version is None else str(version)
+            except Exception:
+                pass
+            return self.version
+
+@st.cache_resource
+def get_sonde_version():
+    """Sonde de version partagée par les sessions du processus"""
+    config = st.secrets.get("cache", {})
+    return SondeVersion(config.get("intervalle_version", INTERVALLE_VERSION))
+
+def version_donnees(conn):
+    """Version courante des données gold (None si inconnue)"""
+    return get_sonde_version().lire(conn)
+
+@st.cache_resource
+def get_cache():
+    """Backend de cache des résultats, configuré par la section [cache] de secrets.toml (mémoire par défaut)"""
+    config = dict(st.secrets.get("cache", {}))
+    config.pop("intervalle_version", None)
+    config.setdefault("ttl", TTL_DEFAUT)
+    return creer_cache(**config)
+
+def executer_cache(conn, sql, params=None, ttl=None):
+    """Table Arrow d'une requête, lue dans le cache ou exécutée puis mise en cache (les erreurs sont levées)"""
+    sql = normaliser_sql(sql)
+    params = normaliser_params(params)
+    cache = get_cache()
+    cle = cle_requete(sql, params, version_donnees(conn))
+    with profiler(sql, params, "cache") as profil:
+        table = cache.lire(cle)
+        if table is None:
+            profil["source"] = "snowflake"
+            table = executer_arrow(conn, sql, params, profil)
+            cache.ecrire(cle, table, ttl)
+        profil.update(lignes=table.num_rows, octets=table.nbytes)
+    return table
+
+def run_query_arrow(conn, sql, params=None, ttl=None):
+    """
+    Exécute une requête avec paramètres liés et retourne une table Arrow
+
+    Le résultat est mis en cache sous cle_requete(sql, params, version_donnees(conn)) :
+    il est servi jusqu'au prochain chargement de la couche gold, dans la limite de `ttl`
+    secondes (TTL du backend par défaut). En cas d'erreur, un message est affiché et une
+    table vide retournée (non mise en cache).
+    """
+    try:
+        return executer_cache(conn, sql, params, ttl)
+    except Exception as e:
+        st.error(f"Erreur lors de l'exécution de la requête: {e}")
+        return pa.table({})
+
+def run_query(conn, sql, params=None, ttl=None):
+    """Comme run_query_arrow, converti en DataFrame"""
+    return vers_pandas(run_query_arrow(conn, sql, params, ttl))
+
+# Calculs d'arrière-plan en cours, par requête : partagés par les sessions du processus
+_calculs = {}
+_calculs_verrou = threading.Lock()
+
+@st.cache_resource
+def get_executeur():
+    """Threads d'exécution des requêtes d'arrière-plan, partagés par les sessions du processus"""
+    return ThreadPoolExecutor(max_workers=REQUETES_ARRIERE_PLAN, thread_name_prefix="requete")
+
+def en_cache(conn, sql, params=None):
+    """Vrai si le résultat de la requête est en cache pour la version courante des données"""
+    cle = cle_requete(normaliser_sql(sql), normaliser_params(params), version_donnees(conn))
+    return get_cache().lire(cle) is not None
+
+def executer_en_arriere_plan(conn, sql, params=None, ttl=None):
+    """
+    Exécute executer_cache dans un thread d'arrière-plan et retourne son Future (table Arrow)
+
+    Le résultat alimente le cache comme run_query. Une requête identique déjà en cours
+    (autre session, clic répété) n'est pas relancée : son Future est partagé.
+    """
+    cle = cle_requete(normaliser_sql(sql), normaliser_params(params))
+    with _calculs_verrou:
+        for termine in [c for c, calcul in _calculs.items() if calcul.done()]:
+            del _calculs[termine]
+        if cle not in _calculs:
+            _calculs[cle] = get_executeur().submit(executer_cache, conn, sql, params, ttl)
+        return _calculs[cle]
+
+def resultat_arriere_plan(calcul):
+    """Table Arrow d'un calcul d'arrière-plan terminé ; comme run_query_arrow, une erreur est affichée et une table vide retournée"""
+    try:
+        return calcul.result()
+    except Exception as e:
+        st.error(f"Erreur lors de l'exécution de la requête: {e}")
+        return pa.table({})
+
+def run_queries(conn, requetes, intervalle=0.05, ttl=None):
+    """
+    Exécute des requêtes indépendantes simultanément et produit (nom, DataFrame) à l'arrivée
+
+    `requetes` est un dict {nom: (sql, params)}. Les résultats déjà en cache sont produits
+    d'abord ; les autres requêtes sont toutes soumises avec execute_async, puis leur
+    statut est interrogé par identifiant de requête (sfqid) : la durée totale est celle
+    de la plus lente, et chaque section peut être affichée dès que son résultat arrive.
+    Les résultats alimentent le même cache que run_query ; une requête en erreur produit
+    un DataFrame vide. Les requêtes non consommées sont annulées.
+    """
+    if isinstance(conn, SourceLocale):
+        # DuckDB embarqué : pas d'exécution asynchrone, les requêtes (locales) se suivent
+        for nom, (sql, params) in requetes.items():
+            yield nom, vers_pandas(run_query_arrow(conn, sql, params, ttl))
+        return
+
+    cache = get_cache()
+    version = version_donnees(conn)
+    with connexion(conn) as conn:
+        prets, en_cours = [], {}
+        try:
+            for nom, (sql, params) in requetes.items():
+                sql, params = normaliser_sql(sql), normaliser_params(params)
+                cle = cle_requete(sql, params, version)
+                debut = time.perf_counter()
+                table = cache.lire(cle)
+                if table is not None:
+                    profil = nouveau_profil(sql, params, "cache")
+                    profil.update(duree=round(time.perf_counter() - debut, 4), lignes=table.num_rows, octets=table.nbytes)
+                    enregistrer_profil(profil)
+                    prets.append((nom, vers_pandas(table)))
+                    continue
+                profil = nouveau_profil(sql, params, "snowflake")
+                debut = time.perf_counter()
+                cursor = conn.cursor()
+                try:
+                    cursor.execute_async(sql, params or None)
+                    profil["sfqid"] = cursor.sfqid
+                    en_cours[cursor.sfqid] = (nom, cle, profil, debut)
+                finally:
+                    cursor.close()
+
+            yield from prets
+
+            while en_cours:
+                for sfqid in list(en_cours):
+                    nom, cle, profil, debut = en_cours[sfqid]
+                    try:
+                        if conn.is_still_running(conn.get_query_status_throw_if_error(sfqid)):
+                            continue
+                        lecture = time.perf_counter()
+                        profil["duree_execution"] = round(lecture - debut, 4)
+                        cursor = conn.cursor()
+                        try:
+                            cursor.get_results_from_sfqid(sfqid)
+                            table = lire_arrow(cursor)
+                        finally:
+                            cursor.close()
+                        profil["duree_lecture"] = round(time.perf_counter() - lecture, 4)
+                        profil.update(lignes=table.num_rows, octets=table.nbytes)
+                        cache.ecrire(cle, table, ttl)
+                        df = vers_pandas(table)
+                    except Exception as e:
+                        profil["erreur"] = str(e)
+                        st.error(f"Erreur lors de l'exécution de la requête: {e}")
+                        df = pd.DataFrame()
+                    profil["duree"] = round(time.perf_counter() - debut, 4)
+                    enregistrer_profil(profil)
+                    del en_cours[sfqid]
+                    yield nom, df
+                if en_cours:
+                    time.sleep(intervalle)
+        finally:
+            for sfqid in en_cours:
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT SYSTEM$CANCEL_QUERY(?)", [sfqid])
+                    cursor.close()
+                except Exception:
+                    pass
+
+def afficher_profil_requetes():
+    """
+    Panneau de débogage (barre latérale) : requêtes de la session avec source, durées,
+    lignes, octets et sfqid (à rechercher dans QUERY_HISTORY de Snowflake)
+
+    Affiché avec ?debug=1 dans l'URL ou `panneau = true` dans la section [profilage].
+    """
+    if st.query_params.get("debug") != "1" and not st.secrets.get("profilage", {}).get("panneau", False):
+        return
+
+    with st.sidebar.expander("🐞 Profil des requêtes"):
+        toutes = st.checkbox("Toutes les sessions", key="profil_toutes_sessions")
+        profils = profils_processus() if toutes else list(st.session_state.get("profil_requetes", []))
+        if not profils:
+            st.caption("Aucune requête enregistrée")
+            return
+
+        df = pd.DataFrame(profils[::-1])
+        executees = df[df["source"] == "snowflake"]
+        st.metric("Requêtes", len(df), f"{(df['source'] == 'cache').mean():.0%} servies par le cache", delta_color="off")
+        st.metric("Temps Snowflake", f"{executees['duree'].sum():.2f} s")
+        st.dataframe(
+            df[["horodatage", "source", "duree", "duree_execution", "duree_lecture",
+                "lignes", "octets", "sfqid", "erreur", "sql"]],
+            hide_index=True,
+            column_config={
+                "duree": st.column_config.NumberColumn("durée (s)", format="%.3f"),
+                "duree_execution": st.column_config.NumberColumn("exécution (s)", format="%.3f"),
+                "duree_lecture": st.column_config.NumberColumn("lecture (s)", format="%.3f"),
+            }
+        )
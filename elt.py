@@ -3,9 +3,30 @@ import pandas as pd
 import requests
 import gzip
 import io
+import os
+import json
+import time
+import hashlib
+import queue
+import shutil
+import tempfile
+import sys
+import argparse
+import threading
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
 from snowflake.connector.pandas_tools import write_pandas
 
+try:
+    import resource
+except ImportError:  # Windows : pas de pic mémoire dans les métriques
+    resource = None
+
 # Configuration Snowflake
 SNOWFLAKE_CONFIG = {
     'user': 'LUCASZUB',
@@ -31,6 +52,59 @@ DEPARTEMENTS = [
     '971', '972', '973', '974', '976'  # DOM-TOM
 ]
 
+BAN_URL = "https://adresse.data.gouv.fr/data/ban/adresses/latest/csv/adresses-{dept}.csv.gz"
+
+# Nombre de lignes par bloc en mode flux
+CHUNKSIZE = 200_000
+
+# Moteur "copy" : fichiers Parquet locaux déposés sur un stage nommé puis un seul COPY INTO
+STAGING_DIR = "ban_parquet"
+STAGE_BAN = "VALFONC_RAW.PUBLIC.BAN_STAGE"
+FORMAT_PARQUET = "VALFONC_RAW.PUBLIC.BAN_PARQUET"
+
+# Moteurs "merge" et "remplacement" : une table transiente de staging par département,
+# fusionnée dans BAN_ADRESSES sur l'identifiant BAN puis supprimée
+TABLE_BAN = "VALFONC_RAW.PUBLIC.BAN_ADRESSES"
+STAGING_BAN = "BAN_ADRESSES_STAGING_{dept}"
+CLE_BAN = "id"
+
+# Destination locale : Parquet partitionné par département
+PARQUET_DIR = "ban_local"
+
+# Schéma BAN : types numériques pour les coordonnées et numéros, catégories pour les
+# champs à faible cardinalité, chaînes Arrow pour le texte libre (colonnes non listées)
+COLONNES_NUMERIQUES = {
+    'numero': 'Int32',
+    'x': 'float64',
+    'y': 'float64',
+    'lon': 'float64',
+    'lat': 'float64',
+    'certification_commune': 'Int8',
+}
+COLONNES_CATEGORIELLES = [
+    'rep', 'code_postal', 'code_insee', 'nom_commune', 'code_insee_ancienne_commune',
+    'nom_ancienne_commune', 'type_position', 'libelle_acheminement', 'source_position',
+    'source_nom_voie',
+]
+TYPE_TEXTE = 'string[pyarrow]'
+
+# Lignes dont une valeur numérique est invalide, écartées du chargement
+REJETS_DIR = "rejets"
+
+# Pipeline : attente (secondes) sur une file avant de vérifier si le pipeline est arrêté
+ATTENTE_FILE = 0.5
+
+# Téléchargements : nombre de tentatives (erreurs réseau et réponses 5xx), attente doublée à chaque reprise
+TENTATIVES = 3
+ATTENTE_REPRISE = 2
+
+# Journal JSON-lines des métriques : un enregistrement par département et une synthèse par run
+METRIQUES_PATH = "elt_metriques.jsonl"
+ETAPES = ["telechargement", "decompression", "parsing", "chargement"]
+
+# Manifest local : état de chargement de chaque département (ETag, empreinte, lignes, statut)
+MANIFEST_PATH = "ban_manifest.json"
+
 def get_snowflake_connection():
     """Crée et retourne une connexion Snowflake"""
     try:
@@ -41,91 +115,1353 @@ def get_snowflake_connection():
         print(f"❌ Erreur de connexion à Snowflake: {e}")
         return None
 
-def telecharger_et_charger_departement(dept, conn):
-    """Télécharge et charge les données d'un département dans Snowflake"""
-    url = f"https://adresse.data.gouv.fr/data/ban/adresses/latest/csv/adresses-{dept}.csv.gz"
-    
+class Manifest:
+    """
+    Manifest local des chargements BAN, un fichier JSON {dept: {...}}
+
+    Chaque entrée conserve l'ETag / Last-Modified de la source, l'empreinte sha256 du
+    fichier compressé, le nombre de lignes chargées et le statut (en_cours, stage,
+    charge, echec). Le fichier est réécrit de façon atomique à chaque mise à jour.
+    """
+
+    def __init__(self, chemin=MANIFEST_PATH):
+        self.chemin = chemin
+        self.verrou = threading.Lock()
+        self.departements = {}
+        if os.path.exists(chemin):
+            with open(chemin, encoding="utf-8") as f:
+                self.departements = json.load(f)
+
+    def get(self, dept):
+        return self.departements.get(dept)
+
+    def statut(self, dept):
+        return (self.departements.get(dept) or {}).get("statut")
+
+    def maj(self, dept, **champs):
+        """Met à jour l'entrée d'un département et réécrit le manifest"""
+        with self.verrou:
+            entree = self.departements.setdefault(dept, {})
+            entree.update(champs)
+            entree["maj"] = datetime.now().isoformat(timespec="seconds")
+
+            tmp = f"{self.chemin}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.departements, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.chemin)
+
+def entetes_conditionnels(precedent):
+    """En-têtes de GET conditionnel pour un département déjà chargé"""
+    if not precedent or precedent.get("statut") != "charge":
+        return {}
+    entetes = {}
+    if precedent.get("etag"):
+        entetes["If-None-Match"] = precedent["etag"]
+    if precedent.get("last_modified"):
+        entetes["If-Modified-Since"] = precedent["last_modified"]
+    return entetes
+
+def requete_avec_reprises(url, source, stream=False, headers=None):
+    """
+    GET avec reprises sur erreur réseau ou réponse 5xx
+
+    Le nombre de reprises est cumulé dans source["reprises"] ; la dernière réponse 5xx
+    est retournée telle quelle (raise_for_status de l'appelant).
+    """
+    for tentative in range(TENTATIVES):
+        derniere = tentative == TENTATIVES - 1
+        try:
+            response = requests.get(url, timeout=60, headers=headers, stream=stream)
+            if response.status_code < 500 or derniere:
+                return response
+            response.close()
+            print(f"🔁 {url} : HTTP {response.status_code}, nouvelle tentative")
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if derniere:
+                raise
+            print(f"🔁 {url} : {e}, nouvelle tentative")
+        source["reprises"] = source.get("reprises", 0) + 1
+        time.sleep(ATTENTE_REPRISE * 2 ** tentative)
+
+def reinitialiser_pic_memoire():
+    """
+    Remet à zéro le pic de mémoire résidente du processus courant
+
+    Sous Linux uniquement (VmHWM, via /proc/self/clear_refs) ; ailleurs le pic reste
+    celui de toute la vie du processus. Retourne True si la remise à zéro a eu lieu.
+    """
     try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def pic_memoire_mo():
+    """
+    Pic de mémoire résidente du processus courant depuis sa dernière remise à zéro, en Mo
+
+    Lu dans /proc/self/status (VmHWM) sous Linux, sinon ru_maxrss ; None sous Windows.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for ligne in f:
+                if ligne.startswith("VmHWM:"):
+                    return round(int(ligne.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en Ko sous Linux et en octets sous macOS
+    return round(pic / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def pic_memoire_run(resultats):
+    """
+    Pic de mémoire résidente d'un run, en Mo, à partir des pics relevés par département
+
+    Pour le processus principal, le plus haut de ses pics par département et de son pic
+    courant (les remises à zéro entre départements font baisser ce dernier). Les processus
+    de parsing du pipeline tournent en même temps que lui : le pic de chacun (le plus haut
+    des départements qu'il a parsés) s'y ajoute.
+    """
+    principal = pic_memoire_mo()
+    parseurs = {}
+    for resultat in resultats.values():
+        pic = resultat.get("pic_memoire_mo")
+        if pic is None:
+            continue
+        processus = resultat.get("processus_parsing")
+        if processus is None:
+            principal = max(principal or 0, pic)
+        else:
+            parseurs[processus] = max(parseurs.get(processus, 0), pic)
+    if principal is None:
+        return None
+    return round(principal + sum(parseurs.values()), 1)
+
+def dtypes_lecture():
+    """dtypes passés à read_csv : les colonnes numériques sont lues en texte puis converties par typer_ban"""
+    dtypes = defaultdict(lambda: TYPE_TEXTE)
+    dtypes.update({col: 'category' for col in COLONNES_CATEGORIELLES})
+    dtypes.update({col: str for col in COLONNES_NUMERIQUES})
+    return dtypes
+
+def typer_ban(df):
+    """
+    Convertit les colonnes numériques selon COLONNES_NUMERIQUES
+
+    Retourne (df typé, rejets) : les lignes dont une valeur n'est pas convertible (texte,
+    décimale ou valeur hors bornes dans une colonne entière) sont retirées du DataFrame et renvoyées telles
+    quelles dans `rejets`, au lieu de faire échouer le département.
+    """
+    valeurs = {}
+    invalide = pd.Series(False, index=df.index)
+    for col, dtype in COLONNES_NUMERIQUES.items():
+        if col not in df.columns:
+            continue
+        brut = df[col]
+        converti = pd.to_numeric(brut, errors='coerce')
+        erreur = brut.notna() & converti.isna()
+        if dtype.startswith('Int'):
+            bornes = np.iinfo(dtype.lower())
+            erreur |= converti.notna() & (
+                (converti % 1 != 0) | (converti < bornes.min) | (converti > bornes.max)
+            )
+        invalide |= erreur
+        valeurs[col] = converti
+
+    rejets = df[invalide]
+    if not rejets.empty:
+        df = df[~invalide].copy()
+    for col, converti in valeurs.items():
+        df[col] = converti[~invalide].astype(COLONNES_NUMERIQUES[col])
+    return df, rejets
+
+def ecrire_rejets(dept, rejets, premier):
+    """Ajoute les lignes rejetées au fichier annexe du département (recréé au premier bloc)"""
+    chemin = os.path.join(REJETS_DIR, f"adresses-{dept}.rejets.csv")
+    if premier and os.path.exists(chemin):
+        os.remove(chemin)
+    if rejets.empty:
+        return
+    os.makedirs(REJETS_DIR, exist_ok=True)
+    rejets.to_csv(chemin, sep=';', index=False, mode='a', header=not os.path.exists(chemin))
+
+def ajouter_duree(source, etape, secondes):
+    """Cumule la durée d'une étape (telechargement, decompression, parsing, chargement) dans `source`"""
+    durees = source.setdefault("durees", {})
+    durees[etape] = durees.get(etape, 0.0) + secondes
+
+def lire_csv_ban(dept, fichier, chunksize=None, source=None):
+    """
+    Lit un CSV BAN avec le schéma typé et écarte les lignes invalides
+
+    Le nombre de rejets et le temps de lecture (étape "parsing", lectures du fichier
+    comprises) sont cumulés dans `source`.
+    """
+    source = {} if source is None else source
+    debut = time.perf_counter()
+    if chunksize is None:
+        blocs = iter([pd.read_csv(fichier, sep=';', dtype=dtypes_lecture())])
+    else:
+        blocs = pd.read_csv(fichier, sep=';', dtype=dtypes_lecture(), chunksize=chunksize)
+
+    partie = 0
+    while True:
+        try:
+            df = next(blocs)
+        except StopIteration:
+            ajouter_duree(source, "parsing", time.perf_counter() - debut)
+            return
+        df, rejets = typer_ban(df)
+        ajouter_duree(source, "parsing", time.perf_counter() - debut)
+
+        ecrire_rejets(dept, rejets, premier=partie == 0)
+        source["rejets"] = source.get("rejets", 0) + len(rejets)
+        if len(rejets):
+            print(f"⚠️  Département {dept} : {len(rejets):,} lignes rejetées → {REJETS_DIR}/")
+        partie += 1
+        yield df
+        debut = time.perf_counter()
+
+def deja_charge(precedent, sha256):
+    """Vrai si le fichier téléchargé est identique à celui du dernier chargement réussi"""
+    return bool(precedent) and precedent.get("statut") == "charge" and precedent.get("sha256") == sha256
+
+class _FluxMesure:
+    """Enveloppe un flux binaire : octets lus, temps passé en lecture et, en option, empreinte sha256"""
+
+    # GzipFile expose un mode entier, pandas attend une chaîne pour détecter un flux binaire
+    mode = "rb"
+
+    def __init__(self, flux, empreinte=False):
+        self.flux = flux
+        self.octets = 0
+        self.duree = 0.0
+        self.empreinte = hashlib.sha256() if empreinte else None
+
+    def read(self, n=-1):
+        return self._mesurer(self.flux.read, n)
+
+    def read1(self, n=-1):
+        return self._mesurer(self.flux.read1, n)
+
+    def _mesurer(self, lire, n):
+        debut = time.perf_counter()
+        data = lire(n)
+        self.duree += time.perf_counter() - debut
+        self.octets += len(data)
+        if self.empreinte is not None:
+            self.empreinte.update(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.flux)
+
+    def __getattr__(self, nom):
+        return getattr(self.flux, nom)
+
+def lire_departement(dept, stream=False, chunksize=CHUNKSIZE, precedent=None, source=None):
+    """
+    Télécharge le CSV BAN d'un département et produit ses DataFrames
+
+    En mode normal, le fichier est téléchargé, décompressé puis lu en entier (un seul
+    DataFrame). En mode flux, le corps HTTP est lu avec stream=True, décompressé à la
+    volée et parsé par blocs de `chunksize` lignes : la mémoire reste bornée par la
+    taille d'un bloc et non plus par celle du département.
+
+    `precedent` est l'entrée du manifest du département : s'il a déjà été chargé, la
+    requête est conditionnelle (If-None-Match / If-Modified-Since). Le dict `source`
+    est complété avec etag, last_modified, sha256 du fichier compressé et `inchange`
+    (True si le serveur répond 304 ou si l'empreinte est identique), auquel cas aucun
+    DataFrame n'est produit. Il reçoit aussi les octets téléchargés / décompressés, la
+    durée de chaque étape ("durees") et le nombre de reprises du téléchargement.
+    """
+    url = BAN_URL.format(dept=dept)
+    source = {} if source is None else source
+    source["inchange"] = False
+    entetes = entetes_conditionnels(precedent)
+
+    if not stream:
         # Télécharger le fichier
         print(f"📥 Téléchargement département {dept}...")
-        response = requests.get(url, timeout=60)
+        debut = time.perf_counter()
+        response = requete_avec_reprises(url, source, headers=entetes)
+        ajouter_duree(source, "telechargement", time.perf_counter() - debut)
+        if response.status_code == 304:
+            source["inchange"] = True
+            return
         response.raise_for_status()
-        
+
+        source["etag"] = response.headers.get("ETag")
+        source["last_modified"] = response.headers.get("Last-Modified")
+        source["octets_telecharges"] = len(response.content)
+        source["sha256"] = hashlib.sha256(response.content).hexdigest()
+        if deja_charge(precedent, source["sha256"]):
+            source["inchange"] = True
+            return
+
         # Dézipper à la volée
         print(f"📦 Décompression département {dept}...")
+        debut = time.perf_counter()
         decompressed = gzip.decompress(response.content)
-        
+        ajouter_duree(source, "decompression", time.perf_counter() - debut)
+        source["octets_decompresses"] = len(decompressed)
+        del response
+
         # Lire avec pandas
         print(f"📊 Lecture CSV département {dept}...")
-        df = pd.read_csv(
-            io.BytesIO(decompressed),
-            sep=';',
-            dtype=str,  # Tout en string pour éviter les problèmes de types
-            low_memory=False
-        )
-        
-        # Ajouter une colonne département pour traçabilité
-        df['departement'] = dept
-        
-        # Charger dans Snowflake
-        print(f"⬆️  Chargement dans Snowflake département {dept} ({len(df):,} lignes)...")
-        
+        blocs = lire_csv_ban(dept, io.BytesIO(decompressed), source=source)
+        del decompressed
+        yield from blocs
+        return
+
+    print(f"📥 Téléchargement en flux département {dept} (blocs de {chunksize:,} lignes)...")
+    debut = time.perf_counter()
+    with requete_avec_reprises(url, source, stream=True, headers=entetes) as response:
+        ajouter_duree(source, "telechargement", time.perf_counter() - debut)
+        if response.status_code == 304:
+            source["inchange"] = True
+            return
+        response.raise_for_status()
+
+        source["etag"] = response.headers.get("ETag")
+        source["last_modified"] = response.headers.get("Last-Modified")
+
+        # Retire un éventuel Content-Encoding HTTP, le gzip du fichier reste à décompresser
+        response.raw.decode_content = True
+        brut = _FluxMesure(response.raw, empreinte=True)
+        with gzip.GzipFile(fileobj=brut) as gz:
+            flux = _FluxMesure(gz)
+            yield from lire_csv_ban(dept, flux, chunksize=chunksize, source=source)
+
+        # Les étapes sont imbriquées : le parsing lit le gzip, qui lit le réseau
+        source["sha256"] = brut.empreinte.hexdigest()
+        source["octets_telecharges"] = brut.octets
+        source["octets_decompresses"] = flux.octets
+        ajouter_duree(source, "telechargement", brut.duree)
+        ajouter_duree(source, "decompression", flux.duree - brut.duree)
+        ajouter_duree(source, "parsing", -flux.duree)
+
+class SinkSnowflake:
+    """
+    Destination VALFONC_RAW.PUBLIC.BAN_ADRESSES
+
+    Moteur "copy" : chaque bloc est écrit en Parquet local et déposé sur un stage nommé,
+    puis un seul COPY INTO charge tous les fichiers en fin de run (les départements ne
+    sont chargés qu'à ce moment), dans la même transaction que la suppression des lignes
+    précédentes des départements rechargés.
+
+    Moteurs "write_pandas", "merge" et "remplacement" : les blocs d'un département sont
+    écrits par write_pandas dans une table transiente de staging, puis appliqués à
+    BAN_ADRESSES en une transaction par terminer(). write_pandas supprime la partition
+    du département et y ajoute le staging tel quel ; merge fusionne sur l'identifiant BAN
+    (mise à jour des adresses modifiées, insertion des nouvelles, suppression de celles
+    absentes du fichier) ; remplacement supprime la partition et réinsère le staging
+    dédoublonné, si bien qu'un rechargement laisse la table à sa taille réelle. Les blocs
+    ne peuvent pas être ajoutés directement dans la transaction : write_pandas crée un
+    stage temporaire (DDL), ce qui valide implicitement la transaction en cours.
+    """
+
+    def __init__(self, moteur="write_pandas"):
+        self.moteur = moteur
+        self.nom = moteur
+        self.charge_differe = moteur == "copy"
+        self.staging = moteur != "copy"
+        self.conn = None
+
+    def ouvrir(self):
+        """Ouvre la connexion d'un worker"""
+        return get_snowflake_connection()
+
+    def fermer(self, conn):
+        conn.close()
+
+    def preparer(self):
+        """Crée le format Parquet et le stage nommé, et vide les fichiers d'un chargement précédent"""
+        if self.moteur != "copy":
+            return True
+        self.conn = get_snowflake_connection()
+        if self.conn is None:
+            return False
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"CREATE FILE FORMAT IF NOT EXISTS {FORMAT_PARQUET} TYPE = PARQUET")
+            cursor.execute(f"CREATE STAGE IF NOT EXISTS {STAGE_BAN} FILE_FORMAT = {FORMAT_PARQUET}")
+            cursor.execute(f"REMOVE @{STAGE_BAN}")
+        finally:
+            cursor.close()
+        return True
+
+    def remplacer(self, conn, dept):
+        """
+        Rien à faire au début d'un département : les lignes d'un chargement précédent sont
+        supprimées dans la transaction qui charge les nouvelles (terminer, finaliser)
+        """
+
+    def ecrire(self, conn, df, dept, partie):
+        """Charge un bloc et retourne (succès, lignes, octets envoyés)"""
+        if self.moteur == "copy":
+            return self.stager_parquet(conn, df, dept, partie)
+
+        # Le premier bloc recrée la table de staging du département
         success, nchunks, nrows, _ = write_pandas(
             conn=conn,
             df=df,
-            table_name='BAN_ADRESSES',
+            table_name=STAGING_BAN.format(dept=dept),
             database='VALFONC_RAW',
             schema='PUBLIC',
             auto_create_table=True,
-            overwrite=False
+            overwrite=partie == 0,
+            table_type='transient'
         )
-        
-        if success:
-            print(f"✅ Département {dept} chargé : {nrows:,} lignes\n")
-            return True, nrows
+        # write_pandas sérialise lui-même le DataFrame : on compte sa taille en mémoire
+        return success, nrows, int(df.memory_usage(deep=True).sum())
+
+    def stager_parquet(self, conn, df, dept, partie):
+        """Écrit un bloc en Parquet compressé et le dépose sur le stage nommé"""
+        dossier = os.path.abspath(os.path.join(STAGING_DIR, dept))
+        os.makedirs(dossier, exist_ok=True)
+        chemin = os.path.join(dossier, f"adresses-{dept}-{partie:04d}.parquet")
+
+        df.to_parquet(chemin, compression='snappy', index=False)
+        octets = os.path.getsize(chemin)
+
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"PUT 'file://{chemin}' @{STAGE_BAN}/{dept}/ AUTO_COMPRESS=FALSE OVERWRITE=TRUE"
+            )
+        finally:
+            cursor.close()
+        os.remove(chemin)
+
+        return True, len(df), octets
+
+    def terminer(self, conn, dept):
+        """Applique le staging d'un département à BAN_ADRESSES en une transaction (tous moteurs sauf copy)"""
+        if not self.staging:
+            return
+
+        staging = f"VALFONC_RAW.PUBLIC.{STAGING_BAN.format(dept=dept)}"
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT * FROM {staging} LIMIT 0")
+            colonnes = [f'"{col[0]}"' for col in cursor.description]
+            # Une adresse présente plusieurs fois dans le fichier n'est gardée qu'une fois
+            dedoublonne = f"""
+                SELECT * FROM {staging}
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY "{CLE_BAN}" ORDER BY "{CLE_BAN}") = 1
+            """
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {TABLE_BAN} LIKE {staging}")
+
+            print(f"🔀 {self.moteur.capitalize()} : département {dept} appliqué à BAN_ADRESSES...")
+            cursor.execute("BEGIN")
+            try:
+                if self.moteur == "merge":
+                    valeurs = [col for col in colonnes if col not in (f'"{CLE_BAN}"', '"departement"')]
+                    cursor.execute(f"""
+                        MERGE INTO {TABLE_BAN} t
+                        USING ({dedoublonne}) s
+                        ON t."{CLE_BAN}" = s."{CLE_BAN}" AND t."departement" = s."departement"
+                        WHEN MATCHED AND ({" OR ".join(f"t.{col} IS DISTINCT FROM s.{col}" for col in valeurs)})
+                            THEN UPDATE SET {", ".join(f"{col} = s.{col}" for col in valeurs)}
+                        WHEN NOT MATCHED
+                            THEN INSERT ({", ".join(colonnes)}) VALUES ({", ".join(f"s.{col}" for col in colonnes)})
+                    """)
+                    # Adresses retirées de la BAN depuis le chargement précédent
+                    cursor.execute(f"""
+                        DELETE FROM {TABLE_BAN} t
+                        WHERE t."departement" = %s
+                          AND NOT EXISTS (SELECT 1 FROM {staging} s WHERE s."{CLE_BAN}" = t."{CLE_BAN}")
+                    """, (dept,))
+                else:
+                    source = f"({dedoublonne})" if self.moteur == "remplacement" else staging
+                    cursor.execute(f'DELETE FROM {TABLE_BAN} WHERE "departement" = %s', (dept,))
+                    cursor.execute(f"""
+                        INSERT INTO {TABLE_BAN} ({", ".join(colonnes)})
+                        SELECT {", ".join(colonnes)} FROM {source}
+                    """)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        finally:
+            cursor.close()
+
+    def supprimer_departements(self, conn, departements):
+        """Supprime de BAN_ADRESSES les lignes des départements à recharger (évite les doublons)"""
+        if not departements:
+            return
+        cursor = conn.cursor()
+        try:
+            placeholders = ", ".join(["%s"] * len(departements))
+            cursor.execute(
+                f'DELETE FROM {TABLE_BAN} WHERE "departement" IN ({placeholders})',
+                list(departements)
+            )
+        except snowflake.connector.errors.ProgrammingError as e:
+            # Premier chargement : la table n'existe pas encore
+            if e.errno != 2003:
+                raise
+        finally:
+            cursor.close()
+
+    def finaliser(self, departements=(), remplacer=True):
+        """
+        Termine le run ; pour le moteur copy, charge tout le stage en un seul COPY INTO
+
+        Retourne le nombre de lignes chargées par le COPY, ou None si rien n'est différé.
+        Les lignes existantes des `departements` rechargés sont supprimées dans la même
+        transaction que le COPY : un COPY en échec les laisse en place.
+        """
+        if self.moteur != "copy":
+            return None
+
+        print(f"\n📥 COPY INTO BAN_ADRESSES depuis @{STAGE_BAN}...")
+        try:
+            cursor = self.conn.cursor()
+            try:
+                # Crée la table à partir du schéma des fichiers Parquet si elle n'existe pas
+                # encore (DDL, hors de la transaction qu'il validerait implicitement)
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {TABLE_BAN}
+                    USING TEMPLATE (
+                        SELECT ARRAY_AGG(OBJECT_CONSTRUCT(*))
+                        FROM TABLE(INFER_SCHEMA(LOCATION => '@{STAGE_BAN}', FILE_FORMAT => '{FORMAT_PARQUET}'))
+                    )
+                """)
+                cursor.execute("BEGIN")
+                try:
+                    if remplacer:
+                        self.supprimer_departements(self.conn, departements)
+                    lignes = self.copier_stage(cursor)
+                    cursor.execute("COMMIT")
+                except Exception:
+                    cursor.execute("ROLLBACK")
+                    raise
+                return lignes
+            finally:
+                cursor.close()
+        finally:
+            self.conn.close()
+
+    def copier_stage(self, cursor):
+        """COPY INTO de tous les fichiers du stage ; retourne le nombre de lignes chargées"""
+        # FORCE : un fichier identique à un chargement précédent (même nom, même
+        # checksum) serait sinon ignoré alors que ses lignes viennent d'être
+        # supprimées ; le stage est vidé à chaque run (preparer), rien n'est chargé deux fois
+        cursor.execute(f"""
+            COPY INTO {TABLE_BAN}
+            FROM @{STAGE_BAN}
+            FILE_FORMAT = (FORMAT_NAME = '{FORMAT_PARQUET}')
+            MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE
+            FORCE = TRUE
+        """)
+        colonnes = [col[0].lower() for col in cursor.description]
+        if "rows_loaded" not in colonnes:
+            # Aucun fichier à charger
+            return 0
+        index = colonnes.index("rows_loaded")
+        return sum(int(ligne[index] or 0) for ligne in cursor.fetchall())
+
+class SinkParquet:
+    """
+    Destination locale : Parquet zstd partitionné par département
+
+    Chaque département est écrit sous `dossier/departement=XX/part-NNNN.parquet` (la
+    colonne departement est portée par le chemin, à la manière d'une partition Hive) et
+    remplacé en entier à chaque rechargement. Avec `duckdb`, une vue ban_adresses est
+    (re)créée dans ce fichier DuckDB : les lectures y sont mappées en mémoire, limitées
+    aux colonnes demandées et aux partitions filtrées, sans crédit d'entrepôt.
+    """
+
+    def __init__(self, dossier=PARQUET_DIR, duckdb=None):
+        self.dossier = os.path.abspath(dossier)
+        self.duckdb = duckdb
+        self.nom = "parquet"
+        self.charge_differe = False
+
+    def ouvrir(self):
+        return self
+
+    def fermer(self, handle):
+        pass
+
+    def preparer(self):
+        os.makedirs(self.dossier, exist_ok=True)
+        return True
+
+    def remplacer(self, handle, dept):
+        # Le premier bloc d'un département vide sa partition (voir ecrire)
+        pass
+
+    def terminer(self, handle, dept):
+        pass
+
+    def ecrire(self, handle, df, dept, partie):
+        """Écrit un bloc dans la partition du département et retourne (succès, lignes, octets écrits)"""
+        partition = os.path.join(self.dossier, f"departement={dept}")
+        if partie == 0:
+            shutil.rmtree(partition, ignore_errors=True)
+        os.makedirs(partition, exist_ok=True)
+
+        chemin = os.path.join(partition, f"part-{partie:04d}.parquet")
+        df.drop(columns='departement').to_parquet(chemin, compression='zstd', index=False)
+        return True, len(df), os.path.getsize(chemin)
+
+    def finaliser(self, departements=(), remplacer=True):
+        """Enregistre la vue ban_adresses dans le fichier DuckDB demandé"""
+        if not self.duckdb:
+            return None
+        try:
+            import duckdb
+        except ImportError:
+            print("❌ Le paquet duckdb n'est pas installé : vue ban_adresses non créée")
+            return None
+
+        fichiers = os.path.join(self.dossier, "*", "*.parquet").replace("'", "''")
+        con = duckdb.connect(self.duckdb)
+        try:
+            con.execute(f"""
+                CREATE OR REPLACE VIEW ban_adresses AS
+                SELECT * FROM read_parquet(
+                    '{fichiers}',
+                    hive_partitioning = true,
+                    hive_types = {{'departement': VARCHAR}}
+                )
+            """)
+        finally:
+            con.close()
+        print(f"🦆 Vue ban_adresses enregistrée dans {self.duckdb}")
+        return None
+
+def creer_sink(nom="snowflake", moteur="write_pandas", dossier=PARQUET_DIR, duckdb=None):
+    """Construit la destination du chargement : snowflake (moteur write_pandas, copy, merge, remplacement) ou parquet"""
+    if nom == "parquet":
+        return SinkParquet(dossier=dossier, duckdb=duckdb)
+    return SinkSnowflake(moteur=moteur)
+
+def nouveau_resultat():
+    """Résultat de chargement d'un département, complété au fil du traitement"""
+    return {
+        "succes": False, "lignes": 0, "octets": 0, "inchange": False, "rejets": 0,
+        "octets_telecharges": 0, "octets_decompresses": 0, "durees": {}, "reprises": 0,
+        "pic_memoire_mo": None, "processus_parsing": None,
+    }
+
+def completer_resultat(resultat, source):
+    """Reporte dans le résultat les métriques collectées pendant le téléchargement et la lecture"""
+    resultat["rejets"] = source.get("rejets", 0)
+    resultat["octets_telecharges"] = source.get("octets_telecharges", 0)
+    resultat["octets_decompresses"] = source.get("octets_decompresses", 0)
+    resultat["durees"] = source.get("durees", {})
+    resultat["reprises"] = source.get("reprises", 0)
+    resultat["pic_memoire_mo"] = source.get("pic_memoire_mo")
+    resultat["processus_parsing"] = source.get("processus_parsing")
+    return resultat
+
+class JournalMetriques:
+    """
+    Journal JSON-lines des chargements
+
+    Un enregistrement {"type": "departement"} par département terminé (octets, lignes,
+    durée par étape, reprises, pic mémoire), puis un enregistrement {"type": "synthese"} en
+    fin de run avec les p50 / p95 de chaque étape et le pic mémoire du run. Le pic par
+    département est celui du processus qui l'a parsé, remis à zéro à son début : il vaut
+    None avec plusieurs threads workers, qui partagent le même processus. Les runs
+    successifs sont ajoutés au même fichier et distingués par leur champ "run".
+    """
+
+    def __init__(self, chemin=METRIQUES_PATH, sink=None):
+        self.chemin = chemin
+        self.sink = sink
+        self.run = datetime.now().isoformat(timespec="seconds")
+        self.verrou = threading.Lock()
+        self.enregistrements = []
+        self.resultats = {}
+
+    def _ecrire(self, enregistrement):
+        with open(self.chemin, "a", encoding="utf-8") as f:
+            f.write(json.dumps(enregistrement) + "\n")
+
+    def enregistrer(self, dept, resultat):
+        """Ajoute l'enregistrement d'un département (appelé depuis les threads workers)"""
+        if resultat["inchange"]:
+            statut = "inchange"
         else:
-            print(f"❌ Erreur lors du chargement du département {dept}\n")
-            return False, 0
-            
+            statut = "charge" if resultat["succes"] else "echec"
+        durees = {etape: round(duree, 3) for etape, duree in resultat["durees"].items()}
+        enregistrement = {
+            "type": "departement",
+            "run": self.run,
+            "horodatage": datetime.now().isoformat(timespec="seconds"),
+            "departement": dept,
+            "sink": self.sink,
+            "statut": statut,
+            "lignes": resultat["lignes"],
+            "rejets": resultat["rejets"],
+            "octets_telecharges": resultat["octets_telecharges"],
+            "octets_decompresses": resultat["octets_decompresses"],
+            "octets_envoyes": resultat["octets"],
+            "durees": durees,
+            "duree_totale": round(sum(durees.values()), 3),
+            "reprises": resultat["reprises"],
+            "pic_memoire_mo": resultat["pic_memoire_mo"],
+        }
+        with self.verrou:
+            self.resultats[dept] = resultat
+            self.enregistrements.append(enregistrement)
+            self._ecrire(enregistrement)
+
+    def synthese(self, finalisation=None):
+        """
+        Écrit et retourne la synthèse du run : p50 / p95 / total par étape et départements les plus lents
+
+        Les départements inchangés (sans parsing ni chargement) sont exclus des percentiles.
+        `finalisation` est la durée de sink.finaliser (COPY INTO du moteur copy, vue DuckDB).
+        """
+        traites = [e for e in self.enregistrements if e["statut"] != "inchange"]
+        etapes = {}
+        for etape in ETAPES:
+            durees = np.array([e["durees"][etape] for e in traites if etape in e["durees"]])
+            if len(durees):
+                p50, p95 = np.percentile(durees, [50, 95])
+                etapes[etape] = {"p50": round(p50, 3), "p95": round(p95, 3), "total": round(durees.sum(), 3)}
+        lents = sorted(traites, key=lambda e: e["duree_totale"], reverse=True)[:5]
+        synthese = {
+            "type": "synthese",
+            "run": self.run,
+            "horodatage": datetime.now().isoformat(timespec="seconds"),
+            "sink": self.sink,
+            "departements": len(self.enregistrements),
+            "echecs": sum(e["statut"] == "echec" for e in self.enregistrements),
+            "reprises": sum(e["reprises"] for e in self.enregistrements),
+            "etapes": etapes,
+            "finalisation": None if finalisation is None else round(finalisation, 3),
+            "plus_lents": [
+                {"departement": e["departement"], "duree_totale": e["duree_totale"]} for e in lents
+            ],
+            "pic_memoire_mo": pic_memoire_run(self.resultats),
+        }
+        with self.verrou:
+            self._ecrire(synthese)
+        return synthese
+
+def charger_blocs(dept, conn, blocs, source, sink, manifest=None):
+    """
+    Charge les DataFrames d'un département dans la destination `sink`
+
+    `conn` est la connexion (ou le handle) du worker, obtenu par sink.ouvrir().
+    `blocs` est un itérable de DataFrames (éventuellement un générateur qui télécharge au
+    fil de l'eau) et `source` le dict de métadonnées complété par lire_departement.
+    Retourne un dict {succes, lignes, octets, inchange, rejets, octets_telecharges,
+    octets_decompresses, durees, reprises}, métriques renseignées y compris en cas
+    d'échec. Avec un `manifest`, les
+    lignes d'un chargement précédent du département sont remplacées plutôt que dupliquées.
+    """
+    resultat = nouveau_resultat()
+
+    try:
+        for partie, df in enumerate(blocs):
+            if partie == 0 and manifest is not None:
+                # Remplace les lignes d'un éventuel chargement précédent (complet ou interrompu)
+                manifest.maj(dept, statut="en_cours")
+                sink.remplacer(conn, dept)
+
+            # Ajouter une colonne département pour traçabilité
+            df['departement'] = pd.Series(dept, index=df.index, dtype='category')
+
+            # Charger dans Snowflake (un appel par bloc en mode flux)
+            print(f"⬆️  Chargement ({sink.nom}) département {dept} ({len(df):,} lignes)...")
+
+            debut = time.perf_counter()
+            success, nrows, nbytes = sink.ecrire(conn, df, dept, partie)
+            ajouter_duree(source, "chargement", time.perf_counter() - debut)
+
+            if not success:
+                print(f"❌ Erreur lors du chargement du département {dept}\n")
+                if manifest is not None:
+                    manifest.maj(dept, statut="echec")
+                return resultat
+
+            resultat["lignes"] += nrows
+            resultat["octets"] += nbytes
+
+        if resultat["lignes"]:
+            # Fin du département : application du staging (tous moteurs sauf copy)
+            debut = time.perf_counter()
+            sink.terminer(conn, dept)
+            ajouter_duree(source, "chargement", time.perf_counter() - debut)
+
+        resultat["succes"] = True
+
+        if source["inchange"]:
+            print(f"⏭️  Département {dept} inchangé depuis le dernier chargement\n")
+            resultat["inchange"] = True
+            return resultat
+
+        if manifest is not None:
+            # Avec le moteur copy, le département n'est chargé qu'après le COPY INTO final
+            manifest.maj(
+                dept,
+                statut="stage" if sink.charge_differe else "charge",
+                etag=source.get("etag"),
+                last_modified=source.get("last_modified"),
+                sha256=source.get("sha256"),
+                lignes=resultat["lignes"],
+                rejets=source.get("rejets", 0)
+            )
+
+        print(f"✅ Département {dept} chargé : {resultat['lignes']:,} lignes\n")
+        return resultat
+
     except requests.exceptions.RequestException as e:
         print(f"❌ Erreur téléchargement département {dept}: {e}\n")
-        return False, 0
     except Exception as e:
         print(f"❌ Erreur département {dept}: {e}\n")
-        return False, 0
+    finally:
+        completer_resultat(resultat, source)
 
-if __name__ == "__main__":
-    print("🗺️  CHARGEMENT BAN DANS SNOWFLAKE")
+    if manifest is not None:
+        manifest.maj(dept, statut="echec")
+    return resultat
+
+def telecharger_et_charger_departement(dept, conn, sink, stream=False, chunksize=CHUNKSIZE, manifest=None):
+    """
+    Télécharge et charge les données d'un département
+
+    Avec un `manifest`, le téléchargement est conditionnel et un département inchangé
+    n'est pas rechargé. Voir charger_blocs pour le résultat.
+    """
+    precedent = manifest.get(dept) if manifest is not None else None
+    source = {}
+    blocs = lire_departement(dept, stream=stream, chunksize=chunksize, precedent=precedent, source=source)
+    return charger_blocs(dept, conn, blocs, source, sink, manifest=manifest)
+
+def charger_departements(departements, sink, workers=1, journal=None, **options):
+    """
+    Charge une liste de départements et retourne {dept: résultat de telecharger_et_charger_departement}
+
+    Les `options` (stream, chunksize, manifest) sont transmises à telecharger_et_charger_departement.
+    Avec un `journal` (JournalMetriques), chaque département terminé y est enregistré.
+
+    Avec workers > 1, les départements sont traités par un pool de threads borné :
+    chaque worker ouvre sa propre connexion à la destination, de sorte que
+    téléchargements, parsing et chargements de départements différents se chevauchent.
+    """
+    resultats = {}
+
+    def terminer(dept, resultat):
+        resultats[dept] = resultat
+        if journal is not None:
+            journal.enregistrer(dept, resultat)
+
+    if workers <= 1:
+        conn = sink.ouvrir()
+        if conn is None:
+            for dept in departements:
+                terminer(dept, nouveau_resultat())
+            return resultats
+
+        for i, dept in enumerate(departements):
+            print(f"\n[{i+1}/{len(departements)}] Traitement département {dept}")
+            print("-" * 50)
+            # Seul département en cours dans le processus : son pic mémoire lui est propre
+            reinitialiser_pic_memoire()
+            resultat = telecharger_et_charger_departement(dept, conn, sink, **options)
+            resultat["pic_memoire_mo"] = pic_memoire_mo()
+            terminer(dept, resultat)
+
+        sink.fermer(conn)
+        return resultats
+
+    # Une connexion par thread worker, fermées en fin de chargement
+    local = threading.local()
+    connexions = []
+    verrou = threading.Lock()
+
+    def traiter(dept):
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = sink.ouvrir()
+            if conn is None:
+                return nouveau_resultat()
+            local.conn = conn
+            with verrou:
+                connexions.append(conn)
+        return telecharger_et_charger_departement(dept, conn, sink, **options)
+
+    print(f"🧵 Chargement parallèle : {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(traiter, dept): dept for dept in departements}
+        for i, future in enumerate(as_completed(futures)):
+            dept = futures[future]
+            try:
+                terminer(dept, future.result())
+            except Exception as e:
+                print(f"❌ Erreur département {dept}: {e}\n")
+                terminer(dept, nouveau_resultat())
+            print(f"[{i+1}/{len(departements)}] Département {dept} terminé")
+
+    for conn in connexions:
+        sink.fermer(conn)
+
+    return resultats
+
+def telecharger_fichier(dept, dossier, precedent=None, source=None):
+    """
+    Télécharge le fichier compressé d'un département sur disque (étage réseau du pipeline)
+
+    Retourne le chemin du fichier, ou None si le département est inchangé (source["inchange"]).
+    """
+    url = BAN_URL.format(dept=dept)
+    source = {} if source is None else source
+    source["inchange"] = False
+
+    print(f"📥 Téléchargement département {dept}...")
+    debut = time.perf_counter()
+    entetes = entetes_conditionnels(precedent)
+    with requete_avec_reprises(url, source, stream=True, headers=entetes) as response:
+        if response.status_code == 304:
+            ajouter_duree(source, "telechargement", time.perf_counter() - debut)
+            source["inchange"] = True
+            return None
+        response.raise_for_status()
+
+        source["etag"] = response.headers.get("ETag")
+        source["last_modified"] = response.headers.get("Last-Modified")
+
+        empreinte = hashlib.sha256()
+        chemin = os.path.join(dossier, f"adresses-{dept}.csv.gz")
+        with open(chemin, "wb") as f:
+            for bloc in response.iter_content(chunk_size=1 << 20):
+                empreinte.update(bloc)
+                f.write(bloc)
+
+    ajouter_duree(source, "telechargement", time.perf_counter() - debut)
+    source["octets_telecharges"] = os.path.getsize(chemin)
+    source["sha256"] = empreinte.hexdigest()
+    if deja_charge(precedent, source["sha256"]):
+        source["inchange"] = True
+        os.remove(chemin)
+        return None
+    return chemin
+
+def parser_fichier(dept, chemin):
+    """
+    Décompresse et parse un fichier téléchargé (étage CPU du pipeline, exécuté dans un processus)
+
+    Le DataFrame est écrit à côté du fichier, en Arrow IPC non compressé, plutôt que renvoyé
+    au processus principal par la file de résultats (pickle en mémoire des deux côtés).
+    Retourne le chemin de ce lot et les métadonnées à fusionner dans `source` (rejets,
+    octets, durées, pic mémoire du processus de parsing).
+    """
+    print(f"📊 Lecture CSV département {dept}...")
+    # Un processus de parsing ne traite qu'un fichier à la fois : pic propre au département
+    reinitialiser_pic_memoire()
+    source = {}
+    with gzip.open(chemin, "rb") as gz:
+        flux = _FluxMesure(gz)
+        df, = lire_csv_ban(dept, flux, source=source)
+    source["octets_decompresses"] = flux.octets
+    ajouter_duree(source, "decompression", flux.duree)
+    ajouter_duree(source, "parsing", -flux.duree)
+    debut = time.perf_counter()
+    lot = chemin + ".arrow"
+    feather.write_feather(df, lot, compression="uncompressed")
+    ajouter_duree(source, "parsing", time.perf_counter() - debut)
+    source["pic_memoire_mo"] = pic_memoire_mo()
+    source["processus_parsing"] = os.getpid()
+    return lot, source
+
+def lire_lot(lot):
+    """Relit un lot Arrow IPC écrit par parser_fichier et le supprime"""
+    table = feather.read_table(lot, memory_map=True)
+    # Les métadonnées pandas ne distinguent pas string[pyarrow] de string[python]
+    df = table.to_pandas(types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get)
+    table = None
+    os.remove(lot)
+    return df
+
+def initialiser_parseur(rejets_dir):
+    """Initialise un processus de parsing : sans fork, il ne voit pas les réglages modifiés du parent"""
+    global REJETS_DIR
+    REJETS_DIR = rejets_dir
+
+def contexte_parseurs():
+    """
+    Méthode de démarrage des processus de parsing : forkserver (spawn à défaut)
+
+    Le pipeline lance ses processus alors que les threads de téléchargement et de
+    chargement tiennent sockets et verrous ; un fork en copierait l'état à mi-opération.
+    """
+    methodes = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methodes else "spawn")
+
+def charger_pipeline(departements, sink, telechargeurs=4, parseurs=None, chargeurs=2, taille_file=4,
+                     manifest=None, journal=None):
+    """
+    Charge les départements avec un pipeline à trois étages découplés
+
+    Des threads de téléchargement écrivent les fichiers compressés sur disque, un pool de
+    processus les décompresse, les parse et écrit chaque DataFrame sur disque en Arrow IPC,
+    et des threads de chargement (une connexion à la destination chacun) relisent ces lots
+    et les envoient. Seuls des chemins transitent entre processus. Les files entre étages
+    sont bornées à `taille_file` éléments : un étage plus lent freine les précédents au
+    lieu de laisser s'accumuler fichiers et lots. Chaque étage se dimensionne indépendamment, pour
+    saturer le réseau et les cœurs sans surcharger l'entrepôt.
+
+    Avec un `journal` (JournalMetriques), chaque département terminé y est enregistré.
+
+    Si un thread d'étage meurt sur une exception inattendue, le pipeline s'arrête : les
+    autres étages cessent d'attendre sur les files, les départements non traités sont
+    marqués en échec et l'exception est relevée (RuntimeError).
+    """
+    parseurs = parseurs or os.cpu_count() or 1
+    a_telecharger = queue.Queue()
+    for dept in departements:
+        a_telecharger.put(dept)
+    a_parser = queue.Queue(maxsize=taille_file)
+    a_charger = queue.Queue(maxsize=taille_file)
+    fin = object()
+    resultats = {}
+    dossier = tempfile.mkdtemp(prefix="ban_")
+    arret = threading.Event()
+    pannes = []
+
+    def deposer(file, item):
+        """Ajoute `item` à la file bornée ; False si le pipeline est arrêté"""
+        while not arret.is_set():
+            try:
+                file.put(item, timeout=ATTENTE_FILE)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def prendre(file):
+        """Prochain élément de la file ; `fin` si le pipeline est arrêté"""
+        while not arret.is_set():
+            try:
+                return file.get(timeout=ATTENTE_FILE)
+            except queue.Empty:
+                pass
+        return fin
+
+    def etage(cible, *args):
+        """Thread d'étage : une exception inattendue arrête le pipeline au lieu de bloquer les autres étages"""
+        def executer():
+            try:
+                cible(*args)
+            except BaseException as e:
+                print(f"❌ Étage {cible.__name__} arrêté : {e!r}\n")
+                pannes.append(e)
+                arret.set()
+        return threading.Thread(target=executer, name=cible.__name__)
+
+    def terminer(dept, resultat):
+        resultats[dept] = resultat
+        if journal is not None:
+            journal.enregistrer(dept, resultat)
+
+    def echec(dept, source):
+        if manifest is not None:
+            manifest.maj(dept, statut="echec")
+        terminer(dept, completer_resultat(nouveau_resultat(), source))
+
+    def telechargeur():
+        while True:
+            try:
+                dept = a_telecharger.get_nowait()
+            except queue.Empty:
+                return
+            precedent = manifest.get(dept) if manifest is not None else None
+            source = {}
+            try:
+                chemin = telecharger_fichier(dept, dossier, precedent, source)
+            except Exception as e:
+                print(f"❌ Erreur téléchargement département {dept}: {e}\n")
+                echec(dept, source)
+                continue
+            if chemin is None:
+                print(f"⏭️  Département {dept} inchangé depuis le dernier chargement\n")
+                terminer(dept, dict(completer_resultat(nouveau_resultat(), source), succes=True, inchange=True))
+                continue
+            if not deposer(a_parser, (dept, chemin, source)):
+                echec(dept, source)
+                return
+
+    def parseur(executor):
+        while True:
+            item = prendre(a_parser)
+            if item is fin:
+                return
+            dept, chemin, source = item
+            try:
+                lot, lecture = executor.submit(parser_fichier, dept, chemin).result()
+            except Exception as e:
+                print(f"❌ Erreur lecture département {dept}: {e}\n")
+                echec(dept, source)
+                continue
+            finally:
+                os.remove(chemin)
+            for etape, duree in lecture.pop("durees").items():
+                ajouter_duree(source, etape, duree)
+            source.update(lecture)
+            if not deposer(a_charger, (dept, lot, source)):
+                echec(dept, source)
+                return
+
+    def chargeur():
+        conn = sink.ouvrir()
+        try:
+            while True:
+                item = prendre(a_charger)
+                if item is fin:
+                    return
+                dept, lot, source = item
+                if conn is None:
+                    echec(dept, source)
+                    continue
+                try:
+                    debut = time.perf_counter()
+                    df = lire_lot(lot)
+                    ajouter_duree(source, "chargement", time.perf_counter() - debut)
+                    terminer(dept, charger_blocs(dept, conn, [df], source, sink, manifest=manifest))
+                except BaseException:
+                    # Le thread s'arrête (voir etage) : le département en cours est en échec
+                    echec(dept, source)
+                    raise
+                df = None
+        finally:
+            if conn is not None:
+                sink.fermer(conn)
+
+    print(f"🏭 Pipeline : {telechargeurs} téléchargements, {parseurs} processus de parsing, "
+          f"{chargeurs} chargements (files de {taille_file})")
+    try:
+        with ProcessPoolExecutor(
+            max_workers=parseurs, mp_context=contexte_parseurs(),
+            initializer=initialiser_parseur, initargs=(REJETS_DIR,)
+        ) as executor:
+            etage_telechargement = [etage(telechargeur) for _ in range(telechargeurs)]
+            etage_parsing = [etage(parseur, executor) for _ in range(parseurs)]
+            etage_chargement = [etage(chargeur) for _ in range(chargeurs)]
+            for thread in etage_telechargement + etage_parsing + etage_chargement:
+                thread.start()
+
+            # Arrêt en cascade : chaque étage se termine quand le précédent a fini
+            for thread in etage_telechargement:
+                thread.join()
+            for _ in etage_parsing:
+                deposer(a_parser, fin)
+            for thread in etage_parsing:
+                thread.join()
+            for _ in etage_chargement:
+                deposer(a_charger, fin)
+            for thread in etage_chargement:
+                thread.join()
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+    if pannes:
+        # Départements restés dans les files quand le pipeline s'est arrêté
+        for file in (a_telecharger, a_parser, a_charger):
+            while not file.empty():
+                item = file.get_nowait()
+                if item is fin:
+                    continue
+                if isinstance(item, tuple):
+                    echec(item[0], item[-1])
+                else:
+                    echec(item, {})
+        raise RuntimeError(f"Pipeline arrêté après la panne d'un étage : {pannes[0]!r}") from pannes[0]
+
+    return resultats
+
+def afficher_synthese(synthese):
+    """Affiche les latences p50 / p95 par étape et les départements les plus longs"""
+    if synthese["etapes"]:
+        print("⏱️  Latences par département (s) :")
+        print(f"   {'étape':<16}{'p50':>9}{'p95':>9}{'total':>10}")
+        for etape, stats in synthese["etapes"].items():
+            print(f"   {etape:<16}{stats['p50']:>9.2f}{stats['p95']:>9.2f}{stats['total']:>10.2f}")
+    if synthese["finalisation"]:
+        print(f"   Finalisation : {synthese['finalisation']:.2f} s")
+    if synthese["plus_lents"]:
+        lents = ", ".join(f"{e['departement']} ({e['duree_totale']:.1f} s)" for e in synthese["plus_lents"])
+        print(f"🐢 Départements les plus longs : {lents}")
+    if synthese["reprises"]:
+        print(f"🔁 Reprises de téléchargement : {synthese['reprises']}")
+    if synthese["pic_memoire_mo"] is not None:
+        print(f"🧠 Pic mémoire : {synthese['pic_memoire_mo']:,.0f} Mo")
+
+def main():
+    parser = argparse.ArgumentParser(description="Chargement de la BAN dans Snowflake ou en Parquet local")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Nombre de départements traités en parallèle (1 = séquentiel)"
+    )
+    parser.add_argument(
+        "--departements", nargs="+", default=DEPARTEMENTS,
+        help="Départements à charger (par défaut : tous)"
+    )
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="Décompresse et charge le CSV par blocs au fil du téléchargement"
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=CHUNKSIZE,
+        help="Nombre de lignes par bloc en mode --stream"
+    )
+    parser.add_argument(
+        "--sink", choices=["snowflake", "parquet"], default="snowflake",
+        help="Destination : table Snowflake BAN_ADRESSES ou Parquet local partitionné par département"
+    )
+    parser.add_argument(
+        "--moteur", choices=["write_pandas", "copy", "merge", "remplacement"], default="write_pandas",
+        help="Sink snowflake. write_pandas : un chargement par département ; "
+             "copy : Parquet sur un stage nommé puis un seul COPY INTO en fin de run ; "
+             "merge / remplacement : table de staging transiente par département, fusionnée "
+             "sur l'identifiant BAN ou substituée à la partition du département"
+    )
+    parser.add_argument(
+        "--dossier-parquet", default=PARQUET_DIR,
+        help="Sink parquet : dossier racine des partitions departement=XX/"
+    )
+    parser.add_argument(
+        "--duckdb",
+        help="Sink parquet : fichier DuckDB où enregistrer la vue ban_adresses"
+    )
+    parser.add_argument(
+        "--manifest",
+        help=f"Manifest local des départements chargés (défaut : {MANIFEST_PATH}, "
+             "ou ban_manifest.json dans le dossier du sink parquet)"
+    )
+    parser.add_argument(
+        "--sans-manifest", action="store_true",
+        help="Ignore le manifest : tout est retéléchargé et ajouté à la table"
+    )
+    parser.add_argument(
+        "--reprise", action="store_true",
+        help="Reprend un chargement interrompu sans réinterroger les départements déjà chargés"
+    )
+    parser.add_argument(
+        "--metriques", default=METRIQUES_PATH,
+        help="Fichier JSON-lines où ajouter les métriques par département et la synthèse du run"
+    )
+    parser.add_argument(
+        "--sans-metriques", action="store_true",
+        help="N'écrit pas le journal de métriques"
+    )
+    pipeline = parser.add_argument_group("pipeline", "Étages découplés téléchargement / parsing / chargement")
+    pipeline.add_argument(
+        "--pipeline", action="store_true",
+        help="Active le pipeline à trois étages (remplace --workers et --stream)"
+    )
+    pipeline.add_argument("--telechargeurs", type=int, default=4, help="Threads de téléchargement")
+    pipeline.add_argument("--parseurs", type=int, default=None, help="Processus de parsing (défaut : nombre de cœurs)")
+    pipeline.add_argument("--chargeurs", type=int, default=2, help="Threads de chargement Snowflake")
+    pipeline.add_argument("--taille-file", type=int, default=4, help="Capacité des files entre étages")
+    args = parser.parse_args()
+
+    sink = creer_sink(args.sink, moteur=args.moteur, dossier=args.dossier_parquet, duckdb=args.duckdb)
+
+    manifest = None
+    departements = args.departements
+    if not args.sans_manifest:
+        chemin_manifest = args.manifest or MANIFEST_PATH
+        if args.manifest is None and args.sink == "parquet":
+            os.makedirs(args.dossier_parquet, exist_ok=True)
+            chemin_manifest = os.path.join(args.dossier_parquet, "ban_manifest.json")
+        manifest = Manifest(chemin_manifest)
+        if args.reprise:
+            departements = [
+                dept for dept in departements
+                if manifest.statut(dept) != "charge"
+            ]
+            print(f"↩️  Reprise : {len(args.departements) - len(departements)} départements déjà chargés ignorés")
+
+    print("🗺️  CHARGEMENT BAN DANS SNOWFLAKE" if args.sink == "snowflake" else "🗺️  CHARGEMENT BAN EN PARQUET LOCAL")
     print("=" * 50)
-    
-    conn = get_snowflake_connection()
-    
-    if conn:
-        start_time = datetime.now()
+
+    journal = None if args.sans_metriques else JournalMetriques(args.metriques, sink=sink.nom)
+
+    start_time = datetime.now()
+
+    if not sink.preparer():
+        return
+
+    if args.pipeline:
+        resultats = charger_pipeline(
+            departements,
+            sink,
+            telechargeurs=args.telechargeurs,
+            parseurs=args.parseurs,
+            chargeurs=args.chargeurs,
+            taille_file=args.taille_file,
+            manifest=manifest,
+            journal=journal
+        )
+    else:
+        resultats = charger_departements(
+            departements,
+            sink,
+            workers=args.workers,
+            stream=args.stream,
+            chunksize=args.chunksize,
+            manifest=manifest,
+            journal=journal
+        )
+
+    reussis = [dept for dept, r in resultats.items() if r["succes"]]
+    inchanges = [dept for dept, r in resultats.items() if r["inchange"]]
+    echoues = [dept for dept in departements if dept not in reussis]
+    total_lignes = sum(r["lignes"] for r in resultats.values())
+    total_octets = sum(r["octets"] for r in resultats.values())
+    total_rejets = sum(r["rejets"] for r in resultats.values())
+
+    charges = [dept for dept in reussis if dept not in inchanges]
+    debut_finalisation = time.perf_counter()
+    try:
+        lignes_differees = sink.finaliser(charges, remplacer=manifest is not None)
+        if lignes_differees is not None:
+            total_lignes = lignes_differees
+            if manifest is not None:
+                for dept in charges:
+                    manifest.maj(dept, statut="charge")
+    except Exception as e:
+        print(f"❌ Erreur de finalisation ({sink.nom}): {e}")
         total_lignes = 0
-        succes = 0
-        echecs = 0
-        
-        for i, dept in enumerate(DEPARTEMENTS):
-            print(f"\n[{i+1}/{len(DEPARTEMENTS)}] Traitement département {dept}")
-            print("-" * 50)
-            
-            success, nrows = telecharger_et_charger_departement(dept, conn)
-            
-            if success:
-                succes += 1
-                total_lignes += nrows
-            else:
-                echecs += 1
-        
-        conn.close()
-        
-        # Résumé
-        duration = datetime.now() - start_time
-        print("\n" + "=" * 50)
-        print("✅ CHARGEMENT TERMINÉ !")
-        print(f"⏱️  Durée : {duration}")
-        print(f"📊 Départements réussis : {succes}/{len(DEPARTEMENTS)}")
-        print(f"❌ Départements échoués : {echecs}")
-        print(f"📈 Total lignes chargées : {total_lignes:,}")
-        print("=" * 50)
\ No newline at end of file
+    duree_finalisation = time.perf_counter() - debut_finalisation
+
+    # Résumé
+    duration = datetime.now() - start_time
+    print("\n" + "=" * 50)
+    print("✅ CHARGEMENT TERMINÉ !")
+    print(f"⏱️  Durée : {duration}")
+    print(f"📊 Départements réussis : {len(reussis)}/{len(departements)}")
+    print(f"⏭️  Départements inchangés : {len(inchanges)}")
+    print(f"❌ Départements échoués : {len(echoues)}")
+    if echoues:
+        print(f"   → {', '.join(sorted(echoues))}")
+    print(f"📈 Total lignes chargées : {total_lignes:,}")
+    if total_rejets:
+        print(f"⚠️  Lignes rejetées : {total_rejets:,} (voir {REJETS_DIR}/)")
+    secondes = max(duration.total_seconds(), 1e-9)
+    print(f"🚀 Débit ({sink.nom}) : {total_lignes / secondes:,.0f} lignes/s")
+    if sink.nom not in ("copy", "parquet"):
+        print(f"📦 Volume envoyé (taille DataFrame) : {total_octets / 1e6:,.1f} Mo")
+    else:
+        print(f"📦 Volume écrit (Parquet) : {total_octets / 1e6:,.1f} Mo")
+
+    if journal is not None:
+        afficher_synthese(journal.synthese(finalisation=duree_finalisation))
+        print(f"🧾 Métriques : {args.metriques}")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Export de la couche gold (VALFONC_ANALYTICS.GOLD) en instantané Parquet local
+
+L'instantané alimente la source locale des pages (source_locale.py, backend = "local") :
+
+- FACT_MUTATION est partitionnée par département et année de mutation
+  (FACT_MUTATION/CODE_DEPARTEMENT=35/ANNEE=2024/part-....parquet), chaque fichier trié
+  par COMMUNE_ID puis DATE_MUTATION pour que les statistiques des row groups permettent
+  d'écarter les blocs hors filtre. L'export est incrémental : seules les lignes dont
+  CREATED_AT dépasse le dernier export (filigrane conservé dans _etat.json) sont lues,
+  et ajoutées dans de nouveaux fichiers ;
+- les tables de dimension et PREDICTION_PRIX, petites, sont réexportées en entier.
+
+Les résultats sont lus par lots Arrow (fetch_arrow_batches) et écrits au fil de l'eau :
+la mémoire reste bornée à un lot quelle que soit la taille de l'export.
+
+    python export_instantane.py                 # incrémental
+    python export_instantane.py --complet       # reconstruit l'instantané
+"""
+import os
+import json
+import shutil
+import argparse
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from config_snowflake import get_snowflake_connection, SECRETS_PATH
+from source_locale import DOSSIER_INSTANTANE, TABLES
+
+ETAT = "_etat.json"
+# Suffixes des dossiers d'un export complet en cours et de l'instantané qu'il remplace
+NOUVEAU = ".nouveau"
+ANCIEN = ".ancien"
+
+# Table de faits : clés de partition (calculées), tri dans chaque fichier, filigrane incrémental
+TABLE_FAITS = "FACT_MUTATION"
+PARTITIONS = ["CODE_DEPARTEMENT", "ANNEE"]
+TRI = ["COMMUNE_ID", "DATE_MUTATION"]
+FILIGRANE = "CREATED_AT"
+# Valeur de partition des lignes sans département ou sans date
+DEPARTEMENT_INCONNU = "inconnu"
+
+# Tables exportées en entier à chaque run, triées sur leur clé
+TABLES_COMPLETES = {
+    "DIM_COMMUNE": "CODE_DEPARTEMENT, COMMUNE_ID",
+    "DIM_TYPE_LOCAL": "TYPE_LOCAL_ID",
+    "DIM_CODE_POSTAL": "CODE_POSTAL_ID",
+    "PREDICTION_PRIX": "1",
+}
+
+LIGNES_PAR_ROW_GROUP = 128_000
+
+def lire_etat(dossier):
+    chemin = os.path.join(dossier, ETAT)
+    if not os.path.exists(chemin):
+        return {}
+    with open(chemin, encoding="utf-8") as f:
+        return json.load(f)
+
+def ecrire_etat(dossier, etat):
+    """Réécrit l'état de façon atomique"""
+    chemin = os.path.join(dossier, ETAT)
+    with open(chemin + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(etat, f, indent=2, ensure_ascii=False)
+    os.replace(chemin + ".tmp", chemin)
+
+def remplacer_dossier(nouveau, actuel):
+    """Met `nouveau` à la place de `actuel` : deux renommages, l'ancien dossier n'est supprimé qu'ensuite"""
+    ancien = actuel + ANCIEN
+    shutil.rmtree(ancien, ignore_errors=True)
+    if os.path.exists(actuel):
+        os.rename(actuel, ancien)
+    os.rename(nouveau, actuel)
+    shutil.rmtree(ancien, ignore_errors=True)
+
+def nettoyer_temporaires(dossier):
+    """Supprime les fichiers .tmp et le dossier d'export complet d'un export interrompu"""
+    shutil.rmtree(os.path.join(dossier, TABLE_FAITS + NOUVEAU), ignore_errors=True)
+    for racine, _, noms in os.walk(dossier):
+        for nom in noms:
+            if nom.endswith(".tmp"):
+                os.remove(os.path.join(racine, nom))
+
+def exporter_table_complete(conn, dossier, table, tri):
+    """Réexporte une table entière dans <dossier>/<table>/part-0.parquet, par lots"""
+    destination = os.path.join(dossier, table)
+    os.makedirs(destination, exist_ok=True)
+    tmp = os.path.join(destination, "part-0.parquet.tmp")
+
+    cursor = conn.cursor()
+    writer = None
+    lignes = 0
+    try:
+        cursor.execute(f"SELECT * FROM VALFONC_ANALYTICS.GOLD.{table} ORDER BY {tri}")
+        for lot in cursor.fetch_arrow_batches():
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, lot.schema, compression="zstd")
+            writer.write_table(lot, row_group_size=LIGNES_PAR_ROW_GROUP)
+            lignes += lot.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+        cursor.close()
+
+    if writer is None:
+        print(f"⚠️  {table} : aucune ligne, fichier précédent conservé")
+        return 0
+    os.replace(tmp, os.path.join(destination, "part-0.parquet"))
+    print(f"📦 {table} : {lignes:,} lignes")
+    return lignes
+
+def morceaux_par_partition(lot):
+    """Découpe un lot trié par partition en (valeurs des clés, morceau sans les colonnes de partition)"""
+    cles = pc.binary_join_element_wise(
+        *[pc.fill_null(pc.cast(lot[col], pa.string()), DEPARTEMENT_INCONNU) for col in PARTITIONS], "\x1f"
+    )
+    sans_partitions = lot.drop_columns(PARTITIONS)
+    for cle in pc.unique(cles).to_pylist():
+        morceau = sans_partitions.filter(pc.equal(cles, cle))
+        yield tuple(cle.split("\x1f")), morceau
+
+def exporter_faits(conn, destination, filigrane=None, run=None):
+    """
+    Exporte dans `destination` les lignes de FACT_MUTATION créées après `filigrane` (toutes si None)
+
+    Les lignes sont lues triées par partition puis par TRI : une seule partition est
+    ouverte en écriture à la fois, et chaque fichier est trié. Les fichiers sont écrits
+    en .tmp puis renommés une fois tout l'export lu. Retourne (lignes, nouveau filigrane).
+    """
+    filtre, params = ("", []) if filigrane is None else (f"WHERE f.{FILIGRANE} > ?", [filigrane])
+    query = f"""
+    SELECT
+        f.*,
+        COALESCE(c.CODE_DEPARTEMENT, '{DEPARTEMENT_INCONNU}') as CODE_DEPARTEMENT,
+        YEAR(f.DATE_MUTATION) as ANNEE
+    FROM VALFONC_ANALYTICS.GOLD.{TABLE_FAITS} f
+    LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c ON f.COMMUNE_ID = c.COMMUNE_ID
+    {filtre}
+    ORDER BY CODE_DEPARTEMENT, ANNEE, {", ".join(f"f.{col}" for col in TRI)}
+    """
+
+    run = run or datetime.now().strftime("%Y%m%dT%H%M%S")
+    ecrits = []
+    writer, partition = None, None
+    lignes, maximum = 0, filigrane
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params or None)
+        for lot in cursor.fetch_arrow_batches():
+            max_lot = pc.max(lot[FILIGRANE]).as_py()
+            if max_lot is not None:
+                max_lot = max_lot.isoformat() if hasattr(max_lot, "isoformat") else str(max_lot)
+                maximum = max_lot if maximum is None else max(maximum, max_lot)
+
+            for valeurs, morceau in morceaux_par_partition(lot):
+                if valeurs != partition:
+                    if writer is not None:
+                        writer.close()
+                    partition = valeurs
+                    dossier_partition = os.path.join(
+                        destination, *[f"{col}={val}" for col, val in zip(PARTITIONS, valeurs)]
+                    )
+                    os.makedirs(dossier_partition, exist_ok=True)
+                    tmp = os.path.join(dossier_partition, f"part-{run}.parquet.tmp")
+                    writer = pq.ParquetWriter(tmp, morceau.schema, compression="zstd")
+                    ecrits.append(tmp)
+                writer.write_table(morceau, row_group_size=LIGNES_PAR_ROW_GROUP)
+                lignes += morceau.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+        cursor.close()
+
+    for tmp in ecrits:
+        os.replace(tmp, tmp[:-len(".tmp")])
+    return lignes, maximum
+
+def main():
+    parser = argparse.ArgumentParser(description="Export de la couche gold en instantané Parquet local")
+    parser.add_argument(
+        "--dossier", default=DOSSIER_INSTANTANE,
+        help="Dossier de l'instantané (un sous-dossier par table)"
+    )
+    parser.add_argument(
+        "--tables", nargs="+", default=TABLES, choices=TABLES,
+        help="Tables à exporter (par défaut : toutes)"
+    )
+    parser.add_argument(
+        "--complet", action="store_true",
+        help=f"Ignore le filigrane et reconstruit {TABLE_FAITS} entièrement"
+    )
+    parser.add_argument(
+        "--secrets", default=SECRETS_PATH,
+        help="Fichier secrets.toml contenant la section [snowflake]"
+    )
+    args = parser.parse_args()
+
+    print("📸 EXPORT DE LA COUCHE GOLD EN PARQUET")
+    print("=" * 50)
+
+    conn = get_snowflake_connection(args.secrets)
+    if conn is None:
+        return
+
+    os.makedirs(args.dossier, exist_ok=True)
+    nettoyer_temporaires(args.dossier)
+    etat = lire_etat(args.dossier)
+    start_time = datetime.now()
+
+    try:
+        for table in args.tables:
+            if table in TABLES_COMPLETES:
+                exporter_table_complete(conn, args.dossier, table, TABLES_COMPLETES[table])
+
+        if TABLE_FAITS in args.tables:
+            filigrane = None if args.complet else etat.get(TABLE_FAITS, {}).get("filigrane")
+            actuel = os.path.join(args.dossier, TABLE_FAITS)
+            if filigrane is None:
+                # Export complet à côté de l'instantané en service, qui reste lisible par la
+                # source locale jusqu'au remplacement (et intact si l'export échoue)
+                destination = actuel + NOUVEAU
+                shutil.rmtree(destination, ignore_errors=True)
+                print(f"🔄 {TABLE_FAITS} : export complet")
+            else:
+                destination = actuel
+                print(f"➕ {TABLE_FAITS} : lignes créées après {filigrane}")
+
+            lignes, maximum = exporter_faits(conn, destination, filigrane)
+            if destination != actuel:
+                remplacer_dossier(destination, actuel)
+            etat[TABLE_FAITS] = {"filigrane": maximum, "export": datetime.now().isoformat(timespec="seconds")}
+            ecrire_etat(args.dossier, etat)
+            print(f"📦 {TABLE_FAITS} : {lignes:,} lignes ajoutées")
+    finally:
+        conn.close()
+
+    print(f"✅ Instantané à jour dans {args.dossier} en {(datetime.now() - start_time).total_seconds():.1f} s")
+
+if __name__ == "__main__":
+    main()
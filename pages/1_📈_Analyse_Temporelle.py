@@ -1,9 +1,25 @@
 import streamlit as st
-import snowflake.connector
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
+from concurrent.futures import wait
+
+import pyarrow.compute as pc
+
+from db import (
+    get_snowflake_connection, executer_cache, run_query_arrow, vers_pandas, version_donnees, TTL_DEFAUT,
+    afficher_profil_requetes, PoolConnexions, en_cache, executer_en_arriere_plan, resultat_arriere_plan,
+)
+from requetes import (
+    GAMMA, POURCENTAGE_APERCU, POURCENTAGE_APERCU_DEPARTEMENT, agregat_a_jour, mois_entiers,
+    requete_cube_agrege, requete_cube_echantillon, requete_cube_mensuel, requete_hierarchie_geographique,
+)
+from warmup import demarrer_prechauffage
+
+# Intervalle (secondes) entre deux vérifications du calcul exact derrière un aperçu
+ATTENTE_APERCU = 1
 
 # Configuration de la page
 st.set_page_config(
@@ -12,176 +28,204 @@ st.set_page_config(
     layout="wide"
 )
 
-# Fonction pour créer la connexion Snowflake
-@st.cache_resource
-def get_snowflake_connection():
-    """Crée et retourne une connexion Snowflake"""
-    try:
-        conn = snowflake.connector.connect(
-            user=st.secrets["snowflake"]["user"],
-            password=st.secrets["snowflake"]["password"],
-            account=st.secrets["snowflake"]["account"],
-            warehouse=st.secrets["snowflake"]["warehouse"],
-            database=st.secrets["snowflake"]["database"],
-            schema=st.secrets["snowflake"]["schema"]
-        )
-        return conn
-    except Exception as e:
-        st.error(f"Erreur de connexion à Snowflake: {e}")
-        return None
+class IndexGeographique:
+    """
+    Hiérarchie département → code postal → commune des mutations, interrogée localement
 
-# Fonction pour exécuter une requête
-@st.cache_data(ttl=600)
-def run_query(_conn, query):
-    """Exécute une requête et retourne un DataFrame"""
-    try:
-        cursor = _conn.cursor()
-        cursor.execute(query)
-        df = cursor.fetch_pandas_all()
-        cursor.close()
-        return df
-    except Exception as e:
-        st.error(f"Erreur lors de l'exécution de la requête: {e}")
-        return pd.DataFrame()
-
-# Fonction pour charger les communes disponibles
-@st.cache_data(ttl=3600)
-def get_communes(_conn):
-    """Récupère la liste des communes"""
-    query = """
-    SELECT DISTINCT c.COMMUNE, c.CODE_DEPARTEMENT
-    FROM VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c
-    INNER JOIN VALFONC_ANALYTICS.GOLD.FACT_MUTATION f ON c.COMMUNE_ID = f.COMMUNE_ID
-    ORDER BY c.COMMUNE
+    Construit une fois à partir des triplets (CODE_DEPARTEMENT, CODE_POSTAL, COMMUNE) :
+    chaque niveau est indexé par un dict de tableaux triés, de sorte que la cascade de
+    filtres de la barre latérale ne sollicite jamais l'entrepôt.
     """
-    return run_query(_conn, query)
-
-# Fonction pour charger les départements
-@st.cache_data(ttl=3600)
-def get_departements(_conn):
-    """Récupère la liste des départements"""
-    query = """
-    SELECT DISTINCT c.CODE_DEPARTEMENT
-    FROM VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c
-    INNER JOIN VALFONC_ANALYTICS.GOLD.FACT_MUTATION f ON c.COMMUNE_ID = f.COMMUNE_ID
-    ORDER BY c.CODE_DEPARTEMENT
+
+    def __init__(self, hierarchie):
+        hierarchie = hierarchie.drop_duplicates()
+        avec_cp = hierarchie.dropna(subset=["CODE_POSTAL"])
+
+        self.departements = sorted(hierarchie["CODE_DEPARTEMENT"].dropna().unique())
+        self.codes_postaux = sorted(avec_cp["CODE_POSTAL"].unique())
+        self._toutes_communes = np.sort(hierarchie["COMMUNE"].dropna().unique())
+        self._communes_par_dept = self._grouper(hierarchie, "CODE_DEPARTEMENT", "COMMUNE")
+        self._communes_par_cp = self._grouper(avec_cp, "CODE_POSTAL", "COMMUNE")
+        self._cp_par_dept = self._grouper(avec_cp, "CODE_DEPARTEMENT", "CODE_POSTAL")
+
+    @staticmethod
+    def _grouper(df, cle, valeur):
+        return {k: np.sort(v.unique()) for k, v in df.groupby(cle)[valeur]}
+
+    def code_postal_du_departement(self, code_postal, departement):
+        """Vrai si le code postal a des mutations dans le département"""
+        codes = self._cp_par_dept.get(departement, np.array([]))
+        i = np.searchsorted(codes, code_postal)
+        return i < len(codes) and codes[i] == code_postal
+
+    def communes(self, departement=None, code_postal=None):
+        """Communes (triées) du département et/ou du code postal, toutes si aucun filtre"""
+        communes = self._toutes_communes
+        if departement:
+            communes = self._communes_par_dept.get(departement, np.array([]))
+        if code_postal:
+            du_cp = self._communes_par_cp.get(code_postal, np.array([]))
+            communes = np.intersect1d(communes, du_cp, assume_unique=True)
+        return communes.tolist()
+
+# Fonction pour charger la hiérarchie géographique (reconstruite quand les données changent)
+@st.cache_resource(ttl=TTL_DEFAUT, max_entries=2)
+def get_index_geographique(_conn, version):
     """
-    return run_query(_conn, query)
-
-def get_postal(_conn):
-    """Récupère la liste des départements"""
-    query = """
-    SELECT DISTINCT P.CODE_POSTAL 
-    FROM VALFONC_ANALYTICS.GOLD.DIM_CODE_POSTAL P
-    INNER JOIN VALFONC_ANALYTICS.GOLD.FACT_MUTATION AS M ON P.CODE_POSTAL_ID = M.CODE_POSTAL_ID
-    ORDER BY P.CODE_POSTAL
+    Charge en une requête la hiérarchie géographique des mutations et l'indexe
+
+    Une erreur est levée, pas mise en cache : l'index n'est pas figé vide pour toute la
+    version des données, la requête est retentée au prochain affichage.
     """
-    return run_query(_conn, query)
+    return IndexGeographique(vers_pandas(executer_cache(_conn, *requete_hierarchie_geographique())))
 
-# Fonction pour récupérer les données temporelles
-@st.cache_data(ttl=600)
-def get_temporal_data(_conn, period_type, commune=None, departement=None, type_local=None, start_date=None, end_date=None):
+# Fonction pour récupérer le cube mensuel
+def get_cube_mensuel(_conn, commune=None, departement=None, start_date=None, end_date=None):
     """
-    Récupère les données agrégées par période avec le prix médian
+    Récupère le cube mois × type de bien × mesure (PRIX, SURFACE) × bucket et ses totaux exacts
+
+    Chaque ligne du cube porte des statistiques fusionnables (NB, SOMME, MINI, MAXI) sur
+    les valeurs d'un bucket logarithmique : leur somme donne nombre, moyenne, min et max
+    de n'importe quel regroupement, et l'histogramme ses quantiles. Trimestres, années et
+    filtre de type de bien se calculent localement (agreger_cube), sans nouvelle requête.
+
+    La même requête (GROUPING SETS) renvoie les totaux par type de bien et le total
+    général, avec leur médiane exacte (MEDIANE). Retourne (cube, totaux) ; dans `totaux`,
+    TYPE_LOCAL vaut "Tous" pour le total général.
+
+    Le cube est lu dans l'agrégat AGG_MUTATION_MONTHLY quand il est à jour et que les
+    dates couvrent des mois entiers, sans parcourir la table de faits ; les médianes des
+    totaux sont alors estimées sur l'histogramme. Sinon, il est calculé sur FACT_MUTATION.
 
     Args:
-        period_type: 'year', 'quarter', 'month'
         commune: filtre par commune
         departement: filtre par département
-        type_local: filtre par type de local
         start_date: date de début
         end_date: date de fin
     """
 
-    # Définir le format de période selon le type
-    if period_type == "year":
-        date_format = "YEAR(f.DATE_MUTATION)"
-        period_label = "ANNEE"
-    elif period_type == "quarter":
-        date_format = "CONCAT(YEAR(f.DATE_MUTATION), '-Q', QUARTER(f.DATE_MUTATION))"
-        period_label = "TRIMESTRE"
-    else:  # month
-        date_format = "TO_CHAR(f.DATE_MUTATION, 'YYYY-MM')"
-        period_label = "MOIS"
-
-    query = f"""
-    SELECT
-        {date_format} as PERIODE,
-        COUNT(*) as NOMBRE_TRANSACTIONS,
-        MEDIAN(f.VALEUR_FONCIERE) as PRIX_MEDIAN,
-        AVG(f.VALEUR_FONCIERE) as PRIX_MOYEN,
-        MIN(f.VALEUR_FONCIERE) as PRIX_MIN,
-        MAX(f.VALEUR_FONCIERE) as PRIX_MAX,
-        MEDIAN(f.SURFACE_REELLE_BATI) as SURFACE_MEDIANE,
-        AVG(f.SURFACE_REELLE_BATI) as SURFACE_MOYENNE
-    FROM VALFONC_ANALYTICS.GOLD.FACT_MUTATION f
-    LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c ON f.COMMUNE_ID = c.COMMUNE_ID
-    LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_TYPE_LOCAL t ON f.TYPE_LOCAL_ID = t.TYPE_LOCAL_ID
-    WHERE 1=1
-        AND f.VALEUR_FONCIERE > 0
-        AND f.DATE_MUTATION IS NOT NULL
+    requete, agregat = requete_cube(_conn, commune, departement, start_date, end_date)
+    return decouper_cube(run_query_arrow(_conn, *requete), agregat)
+
+def requete_cube(_conn, commune=None, departement=None, start_date=None, end_date=None):
+    """(sql, params) du cube exact, et vrai s'il est lu dans l'agrégat AGG_MUTATION_MONTHLY"""
+    agregat = mois_entiers(start_date, end_date) and agregat_a_jour(_conn)
+    requete = requete_cube_agrege if agregat else requete_cube_mensuel
+    return requete(commune, departement, start_date, end_date), agregat
+
+def decouper_cube(table, agregat=False):
+    """Sépare le résultat d'une requête de cube en (cube, totaux), voir get_cube_mensuel"""
+    if table.num_rows == 0:
+        # Résultat vide ou en erreur : mêmes colonnes, pour que les filtres de main s'appliquent
+        return (
+            pd.DataFrame(columns=["MOIS", "TYPE_LOCAL", "MESURE", "BUCKET", "NB", "SOMME", "MINI", "MAXI"]),
+            pd.DataFrame(columns=["TYPE_LOCAL", "MESURE", "NB", "SOMME", "MINI", "MAXI", "MEDIANE"]),
+        )
+
+    # NIVEAU : 0 = cube, 2 = total par type de bien, 3 = total général. Le découpage se
+    # fait sur la table Arrow, chaque partie n'est convertie qu'une fois en DataFrame.
+    cube = vers_pandas(
+        table.filter(pc.equal(table["NIVEAU"], 0))
+        .select(["MOIS", "TYPE_LOCAL", "MESURE", "BUCKET", "NB", "SOMME", "MINI", "MAXI"])
+    )
+    totaux = vers_pandas(
+        table.filter(pc.greater(table["NIVEAU"], 0))
+        .select(["TYPE_LOCAL", "MESURE", "NB", "SOMME", "MINI", "MAXI", "MEDIANE", "NIVEAU"])
+    )
+    totaux.loc[totaux["NIVEAU"] == 3, "TYPE_LOCAL"] = "Tous"
+    totaux = totaux.drop(columns="NIVEAU")
+    if agregat:
+        totaux = estimer_medianes(cube, totaux)
+    return cube, totaux
+
+def get_cube_progressif(conn, commune=None, departement=None, start_date=None, end_date=None):
     """
+    Cube à afficher immédiatement : (cube, totaux, calcul)
 
-    if commune:
-        query += f" AND c.COMMUNE = '{commune}'"
-    if departement:
-        query += f" AND c.CODE_DEPARTEMENT = '{departement}'"
-    if type_local and type_local != "Tous":
-        query += f" AND t.TYPE_LOCAL = '{type_local}'"
-    if start_date:
-        query += f" AND f.DATE_MUTATION >= '{start_date}'"
-    if end_date:
-        query += f" AND f.DATE_MUTATION <= '{end_date}'"
-
-    query += f"""
-    GROUP BY {date_format}
-    ORDER BY PERIODE
+    Sans commune sélectionnée, sur Snowflake, le cube exact d'une vue nationale ou
+    départementale parcourt une grande partie de FACT_MUTATION. S'il n'est ni en cache ni
+    lisible dans l'agrégat, il est lancé en arrière-plan (`calcul`, Future de sa table
+    Arrow) et un aperçu calculé sur un échantillon (requete_cube_echantillon) est retourné
+    en attendant. Dans tous les autres cas, le cube est exact et `calcul` vaut None.
     """
+    requete, agregat = requete_cube(conn, commune, departement, start_date, end_date)
+    if commune is not None or agregat or not isinstance(conn, PoolConnexions) or en_cache(conn, *requete):
+        return (*get_cube_mensuel(conn, commune, departement, start_date, end_date), None)
+
+    calcul = executer_en_arriere_plan(conn, *requete)
+    pourcentage = POURCENTAGE_APERCU if departement is None else POURCENTAGE_APERCU_DEPARTEMENT
+    apercu = run_query_arrow(conn, *requete_cube_echantillon(commune, departement, start_date, end_date, pourcentage))
+    if apercu.num_rows == 0:
+        # Échantillon vide (ou en erreur) : rien à montrer avant le résultat exact
+        return (*decouper_cube(resultat_arriere_plan(calcul)), None)
+    return (*decouper_cube(apercu), calcul)
+
+def suivre_calcul(calcul):
+    """Relance la page dès que le calcul exact est terminé (au plus toutes les ATTENTE_APERCU secondes)"""
+    wait([calcul], timeout=ATTENTE_APERCU)
+    st.rerun()
+
+def estimer_medianes(cube, totaux):
+    """Médianes des totaux estimées sur l'histogramme du cube (l'agrégat n'a pas de médiane exacte)"""
+    medianes = pd.concat([
+        quantile_sketch(cube, ["TYPE_LOCAL", "MESURE"]),
+        quantile_sketch(cube, ["MESURE"]).assign(TYPE_LOCAL="Tous"),
+    ]).rename(columns={"QUANTILE": "MEDIANE"})
+    return totaux.drop(columns="MEDIANE").merge(medianes, on=["TYPE_LOCAL", "MESURE"], how="left")
+
+def libelle_periode(mois, period_type):
+    """Libellé de période d'une série de mois : 2024, 2024-Q1 ou 2024-01"""
+    if period_type == "year":
+        return mois.dt.year.astype(str)
+    if period_type == "quarter":
+        return mois.dt.year.astype(str) + "-Q" + mois.dt.quarter.astype(str)
+    return mois.dt.strftime("%Y-%m")
 
-    return run_query(_conn, query)
+def quantile_sketch(cube, cles, q=0.5):
+    """
+    Quantile `q` de chaque groupe `cles` à partir des buckets du cube
 
-# Fonction pour récupérer les données par type de bien
-@st.cache_data(ttl=600)
-def get_data_by_type(_conn, period_type, commune=None, departement=None, start_date=None, end_date=None):
-    """Récupère les données agrégées par période et type de bien"""
+    Les buckets des mois regroupés sont fusionnés, puis le quantile est lu dans le premier
+    bucket dont le cumul dépasse le rang q × (n - 1). Son estimation (centre relatif du
+    bucket) est ramenée dans le [MINI, MAXI] observé du bucket.
+    """
+    hist = cube.groupby(cles + ["BUCKET"], as_index=False).agg(
+        NB=("NB", "sum"), MINI=("MINI", "min"), MAXI=("MAXI", "max")
+    )
+    groupes = hist.groupby(cles)["NB"]
+    rang = q * (groupes.transform("sum") - 1)
+    premier = hist[groupes.cumsum() > rang].groupby(cles).head(1)
 
-    if period_type == "year":
-        date_format = "YEAR(f.DATE_MUTATION)"
-    elif period_type == "quarter":
-        date_format = "CONCAT(YEAR(f.DATE_MUTATION), '-Q', QUARTER(f.DATE_MUTATION))"
-    else:
-        date_format = "TO_CHAR(f.DATE_MUTATION, 'YYYY-MM')"
-
-    query = f"""
-    SELECT
-        {date_format} as PERIODE,
-        t.TYPE_LOCAL,
-        COUNT(*) as NOMBRE_TRANSACTIONS,
-        MEDIAN(f.VALEUR_FONCIERE) as PRIX_MEDIAN
-    FROM VALFONC_ANALYTICS.GOLD.FACT_MUTATION f
-    LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c ON f.COMMUNE_ID = c.COMMUNE_ID
-    LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_TYPE_LOCAL t ON f.TYPE_LOCAL_ID = t.TYPE_LOCAL_ID
-    WHERE 1=1
-        AND f.VALEUR_FONCIERE > 0
-        AND f.DATE_MUTATION IS NOT NULL
-        AND t.TYPE_LOCAL IN ('MAISON', 'APPARTEMENT')
+    estimation = 2 * GAMMA ** (premier["BUCKET"] + 1) / (GAMMA + 1)
+    return premier[cles].assign(QUANTILE=estimation.clip(premier["MINI"], premier["MAXI"]))
+
+def agreger_cube(cube, period_type, par_type=False):
     """
+    Agrège le cube mensuel par période (et par type de bien si `par_type`)
 
-    if commune:
-        query += f" AND c.COMMUNE = '{commune}'"
-    if departement:
-        query += f" AND c.CODE_DEPARTEMENT = '{departement}'"
-    if start_date:
-        query += f" AND f.DATE_MUTATION >= '{start_date}'"
-    if end_date:
-        query += f" AND f.DATE_MUTATION <= '{end_date}'"
-
-    query += f"""
-    GROUP BY {date_format}, t.TYPE_LOCAL
-    ORDER BY PERIODE, t.TYPE_LOCAL
+    Retourne PERIODE, [TYPE_LOCAL,] NOMBRE_TRANSACTIONS, PRIX_MEDIAN, PRIX_MOYEN, PRIX_MIN,
+    PRIX_MAX, SURFACE_MEDIANE, SURFACE_MOYENNE (colonnes du tableau détaillé).
     """
+    cles = ["PERIODE", "TYPE_LOCAL"] if par_type else ["PERIODE"]
+    cube = cube.assign(PERIODE=libelle_periode(cube["MOIS"], period_type))
 
-    return run_query(_conn, query)
+    stats = cube.groupby(cles + ["MESURE"], as_index=False).agg(
+        NB=("NB", "sum"), SOMME=("SOMME", "sum"), MINI=("MINI", "min"), MAXI=("MAXI", "max")
+    )
+    stats = stats.merge(quantile_sketch(cube, cles + ["MESURE"]), on=cles + ["MESURE"])
+
+    prix = stats[stats["MESURE"] == "PRIX"].set_index(cles)
+    surface = stats[stats["MESURE"] == "SURFACE"].set_index(cles)
+    df = pd.DataFrame({
+        "NOMBRE_TRANSACTIONS": prix["NB"],
+        "PRIX_MEDIAN": prix["QUANTILE"],
+        "PRIX_MOYEN": prix["SOMME"] / prix["NB"],
+        "PRIX_MIN": prix["MINI"],
+        "PRIX_MAX": prix["MAXI"],
+    })
+    df["SURFACE_MEDIANE"] = surface["QUANTILE"]
+    df["SURFACE_MOYENNE"] = surface["SOMME"] / surface["NB"]
+    return df.reset_index().sort_values(cles, ignore_index=True)
 
 # Interface principale
 def main():
@@ -196,6 +240,9 @@ def main():
         st.warning("⚠️ Impossible de se connecter à Snowflake. Veuillez vérifier votre configuration dans .streamlit/secrets.toml")
         return
 
+    # Préchauffage du cache (une fois par processus, en arrière-plan)
+    demarrer_prechauffage()
+
     # Barre latérale avec filtres
     st.sidebar.header("🔍 Filtres")
 
@@ -211,66 +258,38 @@ def main():
     # Filtres géographiques
     st.sidebar.subheader("Localisation")
 
-    # Charger les départements
-    departements_df = get_departements(conn)
-    departements_list = ["Tous"] + sorted(departements_df["CODE_DEPARTEMENT"].tolist())
+    # Hiérarchie géographique chargée une fois, cascade résolue localement
+    try:
+        index_geo = get_index_geographique(conn, version_donnees(conn))
+    except Exception as e:
+        st.error(f"Erreur lors du chargement de la hiérarchie géographique: {e}")
+        return
+
+    departements_list = ["Tous"] + index_geo.departements
     selected_departement = st.sidebar.selectbox("Département", departements_list)
-    
-    # Charger les codes postaux
-    code_postal_df = get_postal(conn)
-    code_postal_list = ["Tous"] + sorted(code_postal_df["CODE_POSTAL"].tolist())
+
+    code_postal_list = ["Tous"] + index_geo.codes_postaux
     selected_code_postal = st.sidebar.selectbox("Code Postal", code_postal_list)
 
+    # Si le code postal sélectionné n'appartient pas au département, on l'ignore (évite le mélange 35 vs 45)
+    selected_code_postal_effective = selected_code_postal
+    if (
+        selected_departement != "Tous"
+        and selected_code_postal != "Tous"
+        and not index_geo.code_postal_du_departement(selected_code_postal, selected_departement)
+    ):
+        st.sidebar.warning("Le code postal sélectionné n'appartient pas au département choisi. Le filtre code postal est ignoré.")
+        selected_code_postal_effective = "Tous"
+
     # Filtre commune (filtre par département ET/OU code postal)
-    selected_commune = None
-    # Récupérer toutes les communes disponibles
-    communes_df = get_communes(conn)
-
-    # Appliquer filtre département si nécessaire
-    if selected_departement != "Tous":
-        communes_df = communes_df[communes_df["CODE_DEPARTEMENT"] == selected_departement]
-
-        # Récupérer les codes postaux valides pour le département sélectionné
-        query_cp_dept = f"""
-        SELECT DISTINCT p.CODE_POSTAL
-        FROM VALFONC_ANALYTICS.GOLD.DIM_CODE_POSTAL p
-        INNER JOIN VALFONC_ANALYTICS.GOLD.FACT_MUTATION m ON p.CODE_POSTAL_ID = m.CODE_POSTAL_ID
-        INNER JOIN VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c ON m.COMMUNE_ID = c.COMMUNE_ID
-        WHERE c.CODE_DEPARTEMENT = '{selected_departement}'
-        ORDER BY p.CODE_POSTAL
-        """
-        cp_dept_df = run_query(conn, query_cp_dept)
-        valid_cp = set(cp_dept_df["CODE_POSTAL"].tolist()) if not cp_dept_df.empty else set()
-
-        # Si le code postal sélectionné n'appartient pas au département, on l'ignore (évite le mélange 35 vs 45)
-        if selected_code_postal != "Tous" and selected_code_postal not in valid_cp:
-            st.sidebar.warning("Le code postal sélectionné n'appartient pas au département choisi. Le filtre code postal est ignoré.")
-            selected_code_postal_effective = "Tous"
-        else:
-            selected_code_postal_effective = selected_code_postal
-    else:
-        selected_code_postal_effective = selected_code_postal
-
-    # Appliquer filtre code postal si nécessaire (obtenir les communes liées au code postal)
-    if selected_code_postal_effective != "Tous":
-        query_communes_par_cp = f"""
-        SELECT DISTINCT c.COMMUNE, c.CODE_DEPARTEMENT
-        FROM VALFONC_ANALYTICS.GOLD.DIM_CODE_POSTAL p
-        INNER JOIN VALFONC_ANALYTICS.GOLD.FACT_MUTATION m ON p.CODE_POSTAL_ID = m.CODE_POSTAL_ID
-        INNER JOIN VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c ON m.COMMUNE_ID = c.COMMUNE_ID
-        WHERE p.CODE_POSTAL = '{selected_code_postal_effective}'
-        ORDER BY c.COMMUNE
-        """
-        communes_par_cp = run_query(conn, query_communes_par_cp)
-        # Intersecter avec les communes déjà filtrées par département (si applicable)
-        if not communes_df.empty:
-            communes_df = communes_df[communes_df["COMMUNE"].isin(communes_par_cp["COMMUNE"].tolist())]
-        else:
-            communes_df = communes_par_cp
+    communes = index_geo.communes(
+        departement=None if selected_departement == "Tous" else selected_departement,
+        code_postal=None if selected_code_postal_effective == "Tous" else selected_code_postal_effective
+    )
 
     # Construire la liste des communes à afficher
-    if not communes_df.empty:
-        communes_list = ["Toutes"] + sorted(communes_df["COMMUNE"].tolist())
+    if communes:
+        communes_list = ["Toutes"] + communes
         selected_commune = st.sidebar.selectbox("Commune", communes_list)
         if selected_commune == "Toutes":
             selected_commune = None
@@ -292,29 +311,44 @@ def main():
     with col2:
         end_date = st.date_input("Date fin", value=None)
 
-    # Bouton d'analyse
-    if st.sidebar.button("🔎 Analyser", type="primary"):
-        departement_filter = None if selected_departement == "Tous" else selected_departement
+    # Bouton d'analyse : charge le cube mensuel des filtres géographiques et de dates.
+    # Granularité et type de bien sont appliqués localement, sans recharger le cube.
+    departement_filter = None if selected_departement == "Tous" else selected_departement
+    filtres = (selected_commune, departement_filter, start_date, end_date)
 
+    if st.sidebar.button("🔎 Analyser", type="primary"):
         with st.spinner("Chargement des données..."):
-            df = get_temporal_data(
-                conn,
-                period_type,
-                selected_commune,
-                departement_filter,
-                selected_type,
-                start_date,
-                end_date
+            st.session_state["analyse_temporelle"] = (filtres, *get_cube_progressif(conn, *filtres))
+
+    analyse = st.session_state.get("analyse_temporelle")
+    if analyse is not None and analyse[0] != filtres:
+        st.info("Les filtres ont changé : cliquez sur 🔎 Analyser pour mettre à jour l'analyse")
+    elif analyse is not None:
+        _, cube, totaux, calcul = analyse
+        if calcul is not None and calcul.done():
+            # Le résultat exact remplace l'aperçu
+            cube, totaux = decouper_cube(resultat_arriere_plan(calcul))
+            calcul = None
+            st.session_state["analyse_temporelle"] = (filtres, cube, totaux, None)
+
+        # Aperçu : chiffres extrapolés d'un échantillon, signalés par "≈"
+        approx = "≈ " if calcul is not None else ""
+        if calcul is not None:
+            st.info(
+                "⏳ **Aperçu approximatif**, calculé sur un échantillon des mutations. "
+                "Le calcul exact est en cours et remplacera ces chiffres automatiquement."
             )
 
-        if df.empty:
+        cube_type = cube if selected_type == "Tous" else cube[cube["TYPE_LOCAL"] == selected_type]
+        if cube_type.empty:
             st.warning("Aucune transaction trouvée avec ces critères")
+            if calcul is not None:
+                suivre_calcul(calcul)
             return
 
-        # Conversion des types
-        df["PRIX_MEDIAN"] = pd.to_numeric(df["PRIX_MEDIAN"], errors="coerce")
-        df["PRIX_MOYEN"] = pd.to_numeric(df["PRIX_MOYEN"], errors="coerce")
-        df["NOMBRE_TRANSACTIONS"] = pd.to_numeric(df["NOMBRE_TRANSACTIONS"], errors="coerce")
+        df = agreger_cube(cube_type, period_type)
+        # Total du type sélectionné (ou général), sur toute la plage de dates
+        total_prix = totaux[(totaux["TYPE_LOCAL"] == selected_type) & (totaux["MESURE"] == "PRIX")].iloc[0]
 
         # Métriques globales
         st.header("📊 Vue d'ensemble")
@@ -323,15 +357,15 @@ def main():
 
         with col1:
             total_transactions = df["NOMBRE_TRANSACTIONS"].sum()
-            st.metric("Total transactions", f"{int(total_transactions):,}")
+            st.metric("Total transactions", f"{approx}{int(total_transactions):,}")
 
         with col2:
-            prix_median_global = df["PRIX_MEDIAN"].median()
-            st.metric("Prix médian global", f"{prix_median_global:,.0f} €")
+            prix_median_global = total_prix["MEDIANE"]
+            st.metric("Prix médian global", f"{approx}{prix_median_global:,.0f} €")
 
         with col3:
-            prix_moyen_global = df["PRIX_MOYEN"].mean()
-            st.metric("Prix moyen global", f"{prix_moyen_global:,.0f} €")
+            prix_moyen_global = total_prix["SOMME"] / total_prix["NB"]
+            st.metric("Prix moyen global", f"{approx}{prix_moyen_global:,.0f} €")
 
         with col4:
             nb_periodes = len(df)
@@ -415,18 +449,10 @@ def main():
         # Analyse par type de bien
         st.header("🏘️ Comparaison par type de bien")
 
-        with st.spinner("Chargement de la comparaison par type..."):
-            df_by_type = get_data_by_type(
-                conn,
-                period_type,
-                selected_commune,
-                departement_filter,
-                start_date,
-                end_date
-            )
+        cube_comparaison = cube[cube["TYPE_LOCAL"].isin(["MAISON", "APPARTEMENT"])]
 
-        if not df_by_type.empty:
-            df_by_type["PRIX_MEDIAN"] = pd.to_numeric(df_by_type["PRIX_MEDIAN"], errors="coerce")
+        if not cube_comparaison.empty:
+            df_by_type = agreger_cube(cube_comparaison, period_type, par_type=True)
 
             fig_types = px.line(
                 df_by_type,
@@ -448,41 +474,55 @@ def main():
             # Statistiques par type
             st.subheader("📋 Statistiques par type de bien")
 
-            stats_by_type = df_by_type.groupby("TYPE_LOCAL").agg({
-                "NOMBRE_TRANSACTIONS": "sum",
-                "PRIX_MEDIAN": "median"
-            }).reset_index()
-
-            stats_by_type.columns = ["Type de bien", "Total transactions", "Prix médian"]
-            stats_by_type["Prix médian"] = stats_by_type["Prix médian"].apply(lambda x: f"{x:,.0f} €")
-            stats_by_type["Total transactions"] = stats_by_type["Total transactions"].apply(lambda x: f"{int(x):,}")
-
-            st.dataframe(stats_by_type, use_container_width=True, hide_index=True)
+            stats_by_type = totaux[
+                totaux["TYPE_LOCAL"].isin(["MAISON", "APPARTEMENT"]) & (totaux["MESURE"] == "PRIX")
+            ][["TYPE_LOCAL", "NB", "MEDIANE"]].sort_values("TYPE_LOCAL")
+
+            st.dataframe(
+                stats_by_type,
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "TYPE_LOCAL": "Type de bien",
+                    "NB": st.column_config.NumberColumn("Total transactions", format="%d"),
+                    "MEDIANE": st.column_config.NumberColumn("Prix médian", format="%.0f €"),
+                }
+            )
 
         st.markdown("---")
 
         # Tableau détaillé
         st.header("📋 Données détaillées")
 
-        df_display = df.copy()
-        df_display["PRIX_MEDIAN"] = df_display["PRIX_MEDIAN"].apply(lambda x: f"{x:,.0f} €" if pd.notna(x) else "N/A")
-        df_display["PRIX_MOYEN"] = df_display["PRIX_MOYEN"].apply(lambda x: f"{x:,.0f} €" if pd.notna(x) else "N/A")
-        df_display["PRIX_MIN"] = df_display["PRIX_MIN"].apply(lambda x: f"{x:,.0f} €" if pd.notna(x) else "N/A")
-        df_display["PRIX_MAX"] = df_display["PRIX_MAX"].apply(lambda x: f"{x:,.0f} €" if pd.notna(x) else "N/A")
-        df_display["NOMBRE_TRANSACTIONS"] = df_display["NOMBRE_TRANSACTIONS"].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "N/A")
-
-        df_display.columns = ["Période", "Nombre transactions", "Prix médian", "Prix moyen", "Prix min", "Prix max", "Surface médiane", "Surface moyenne"]
-
-        st.dataframe(df_display, use_container_width=True, height=400)
-
-        # Export CSV
-        csv = df.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="📥 Télécharger les données (CSV)",
-            data=csv,
-            file_name=f"dvf_analyse_temporelle_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
+        # Colonnes numériques formatées à l'affichage, sans copie ni conversion en texte
+        st.dataframe(
+            df,
+            use_container_width=True,
+            height=400,
+            column_config={
+                "PERIODE": "Période",
+                "NOMBRE_TRANSACTIONS": st.column_config.NumberColumn("Nombre transactions", format="%d"),
+                "PRIX_MEDIAN": st.column_config.NumberColumn("Prix médian", format="%.0f €"),
+                "PRIX_MOYEN": st.column_config.NumberColumn("Prix moyen", format="%.0f €"),
+                "PRIX_MIN": st.column_config.NumberColumn("Prix min", format="%.0f €"),
+                "PRIX_MAX": st.column_config.NumberColumn("Prix max", format="%.0f €"),
+                "SURFACE_MEDIANE": st.column_config.NumberColumn("Surface médiane", format="%.0f m²"),
+                "SURFACE_MOYENNE": st.column_config.NumberColumn("Surface moyenne", format="%.0f m²"),
+            }
         )
 
+        # Export CSV, des seules données exactes
+        if calcul is None:
+            csv = df.to_csv(index=False).encode('utf-8')
+            st.download_button(
+                label="📥 Télécharger les données (CSV)",
+                data=csv,
+                file_name=f"dvf_analyse_temporelle_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime="text/csv"
+            )
+        else:
+            suivre_calcul(calcul)
+
 if __name__ == "__main__":
     main()
+    afficher_profil_requetes()
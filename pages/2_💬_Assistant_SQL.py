@@ -1,9 +1,9 @@
 import streamlit as st
-import snowflake.connector
-import pandas as pd
 import json
 from datetime import datetime
 
+from db import get_snowflake_connection, connexion, executer, afficher_profil_requetes
+
 # Configuration de la page
 st.set_page_config(
     page_title="Assistant SQL DVF",
@@ -11,77 +11,8 @@ st.set_page_config(
     layout="wide"
 )
 
-# Fonction pour créer la connexion Snowflake
-@st.cache_resource
-def get_snowflake_connection():
-    """Crée et retourne une connexion Snowflake"""
-    try:
-        conn = snowflake.connector.connect(
-            user=st.secrets["snowflake"]["user"],
-            password=st.secrets["snowflake"]["password"],
-            account=st.secrets["snowflake"]["account"],
-            warehouse=st.secrets["snowflake"]["warehouse"],
-            database=st.secrets["snowflake"]["database"],
-            schema=st.secrets["snowflake"]["schema"]
-        )
-        return conn
-    except Exception as e:
-        st.error(f"Erreur de connexion à Snowflake: {e}")
-        return None
-
-# Fonction pour appeler l'agent Snowflake
-def call_agent(conn, message, conversation_history=None):
-    """
-    Appelle l'agent Snowflake ASSISTANTSQLDVF avec un message
-    Retourne un dict avec 'response', 'sql_query', et 'metadata'
-    """
-    try:
-        cursor = conn.cursor()
-
-        # Méthode 1: Essayer d'appeler l'agent directement via CALL
-        try:
-            # Construire l'historique de conversation si disponible
-            history_str = ""
-            if conversation_history:
-                messages = []
-                for msg in conversation_history[-5:]:  # Garder les 5 derniers messages pour le contexte
-                    role = msg["role"]
-                    content = msg["content"].replace("'", "''")
-                    messages.append(f"{{'role': '{role}', 'content': '{content}'}}")
-                history_str = ", ".join(messages)
-
-            # Ajouter le message actuel
-            escaped_message = message.replace("'", "''")
-            current_msg = f"{{'role': 'user', 'content': '{escaped_message}'}}"
-            if history_str:
-                full_messages = f"[{history_str}, {current_msg}]"
-            else:
-                full_messages = f"[{current_msg}]"
-
-            # Appel à l'agent
-            agent_call = f"CALL ASSISTANTSQLDVF!CHAT({full_messages})"
-
-            cursor.execute(agent_call)
-            result = cursor.fetchall()
-
-            if result:
-                # Parser la réponse de l'agent
-                # Le format de réponse dépend de la configuration de l'agent
-                response_text = str(result[0][0]) if result[0] else "Pas de réponse."
-
-                return {
-                    "response": response_text,
-                    "sql_query": None,
-                    "metadata": None
-                }
-
-        except Exception as e1:
-            # Méthode 2: Si la méthode 1 échoue, essayer avec une approche alternative
-            # Utiliser SNOWFLAKE.CORTEX.COMPLETE comme fallback
-            st.warning(f"Méthode d'appel direct échouée: {e1}")
-
-            # Essayer avec un prompt structuré pour générer du SQL
-            prompt = f"""En tant qu'expert SQL, analysez cette question sur les données DVF (Demandes de Valeurs Foncières) et générez une requête SQL appropriée.
+# Prompt du repli Cortex (question insérée par format)
+PROMPT_SQL = """En tant qu'expert SQL, analysez cette question sur les données DVF (Demandes de Valeurs Foncières) et générez une requête SQL appropriée.
 
 Question: {message}
 
@@ -97,50 +28,93 @@ RÉPONSE: [explication en français]
 SQL: [requête SQL]
 """
 
-            escaped_prompt = prompt.replace("'", "''")
-            llm_query = f"""
-            SELECT SNOWFLAKE.CORTEX.COMPLETE(
-                'mistral-large',
-                '{escaped_prompt}'
-            ) as response
-            """
-
-            cursor.execute(llm_query)
-            llm_result = cursor.fetchone()
-
-            if llm_result and llm_result[0]:
-                response_text = str(llm_result[0])
-
-                # Essayer d'extraire la requête SQL de la réponse
-                sql_query = None
-                if "SQL:" in response_text:
-                    parts = response_text.split("SQL:")
-                    if len(parts) > 1:
-                        sql_query = parts[1].strip()
-                        # Nettoyer la requête SQL
-                        if "```sql" in sql_query:
-                            sql_query = sql_query.split("```sql")[1].split("```")[0].strip()
-                        elif "```" in sql_query:
-                            sql_query = sql_query.split("```")[1].split("```")[0].strip()
-
-                return {
-                    "response": response_text,
-                    "sql_query": sql_query,
-                    "metadata": {"method": "cortex_complete"}
-                }
-            else:
-                raise Exception("Aucune réponse obtenue de Cortex")
-
+# Fonction pour appeler l'agent Snowflake
+def call_agent(conn, message, conversation_history=None):
+    """
+    Appelle l'agent Snowflake ASSISTANTSQLDVF avec un message
+    Retourne un dict avec 'response', 'sql_query', et 'metadata'
+    """
+    try:
+        # Connexion empruntée au pool pour toute la durée de l'échange
+        with connexion(conn) as conn:
+            cursor = conn.cursor()
+            try:
+                # Méthode 1: Essayer d'appeler l'agent directement via CALL
+                try:
+                    # Construire l'historique de conversation si disponible
+                    messages = []
+                    if conversation_history:
+                        for msg in conversation_history[-5:]:  # Garder les 5 derniers messages pour le contexte
+                            messages.append({"role": msg["role"], "content": msg["content"]})
+
+                    # Ajouter le message actuel
+                    messages.append({"role": "user", "content": message})
+
+                    # Appel à l'agent (messages passés en paramètre lié, sans échappement manuel)
+                    cursor.execute("CALL ASSISTANTSQLDVF!CHAT(PARSE_JSON(?))", [json.dumps(messages)])
+                    result = cursor.fetchall()
+
+                    if result:
+                        # Parser la réponse de l'agent
+                        # Le format de réponse dépend de la configuration de l'agent
+                        response_text = str(result[0][0]) if result[0] else "Pas de réponse."
+
+                        return {
+                            "response": response_text,
+                            "sql_query": None,
+                            "metadata": None
+                        }
+
+                except Exception as e1:
+                    # Méthode 2: Si la méthode 1 échoue, essayer avec une approche alternative
+                    # Utiliser SNOWFLAKE.CORTEX.COMPLETE comme fallback
+                    st.warning(f"Méthode d'appel direct échouée: {e1}")
+
+                    # Essayer avec un prompt structuré pour générer du SQL
+                    prompt = PROMPT_SQL.format(message=message)
+
+                    llm_query = """
+                    SELECT SNOWFLAKE.CORTEX.COMPLETE(
+                        'mistral-large',
+                        ?
+                    ) as response
+                    """
+
+                    cursor.execute(llm_query, [prompt])
+                    llm_result = cursor.fetchone()
+
+                    if llm_result and llm_result[0]:
+                        response_text = str(llm_result[0])
+
+                        # Essayer d'extraire la requête SQL de la réponse
+                        sql_query = None
+                        if "SQL:" in response_text:
+                            parts = response_text.split("SQL:")
+                            if len(parts) > 1:
+                                sql_query = parts[1].strip()
+                                # Nettoyer la requête SQL
+                                if "```sql" in sql_query:
+                                    sql_query = sql_query.split("```sql")[1].split("```")[0].strip()
+                                elif "```" in sql_query:
+                                    sql_query = sql_query.split("```")[1].split("```")[0].strip()
+
+                        return {
+                            "response": response_text,
+                            "sql_query": sql_query,
+                            "metadata": {"method": "cortex_complete"}
+                        }
+                    else:
+                        raise Exception("Aucune réponse obtenue de Cortex")
+            finally:
+                cursor.close()
     except Exception as e:
+        # Y compris l'attente d'une connexion libre du pool (TimeoutError)
         st.error(f"Erreur lors de l'appel à l'agent: {e}")
         return {
             "response": f"Désolé, je n'ai pas pu traiter votre demande. Erreur: {str(e)}",
             "sql_query": None,
             "metadata": {"error": str(e)}
         }
-    finally:
-        if cursor:
-            cursor.close()
 
 # Fonction pour exécuter une requête SQL (si l'agent retourne une requête)
 def execute_sql_query(conn, query):
@@ -148,11 +122,7 @@ def execute_sql_query(conn, query):
     Exécute une requête SQL et retourne un DataFrame
     """
     try:
-        cursor = conn.cursor()
-        cursor.execute(query)
-        df = cursor.fetch_pandas_all()
-        cursor.close()
-        return df
+        return executer(conn, query)
     except Exception as e:
         st.error(f"Erreur lors de l'exécution de la requête: {e}")
         return None
@@ -290,3 +260,4 @@ def main():
 
 if __name__ == "__main__":
     main()
+    afficher_profil_requetes()
@@ -1,6 +1,9 @@
 import streamlit as st
-import snowflake.connector
-import pandas as pd
+from contextlib import closing
+
+from db import get_snowflake_connection, run_query, run_queries, afficher_profil_requetes
+from requetes import requete_zones_stats
+from warmup import demarrer_prechauffage
 
 # Configuration de la page
 st.set_page_config(
@@ -9,61 +12,10 @@ st.set_page_config(
     layout="wide"
 )
 
-# Fonction pour créer la connexion Snowflake
-@st.cache_resource
-def get_snowflake_connection():
-    """Crée et retourne une connexion Snowflake"""
-    try:
-        conn = snowflake.connector.connect(
-            user=st.secrets["snowflake"]["user"],
-            password=st.secrets["snowflake"]["password"],
-            account=st.secrets["snowflake"]["account"],
-            warehouse=st.secrets["snowflake"]["warehouse"],
-            database=st.secrets["snowflake"]["database"],
-            schema=st.secrets["snowflake"]["schema"]
-        )
-        return conn
-    except Exception as e:
-        st.error(f"Erreur de connexion à Snowflake: {e}")
-        return None
-
-# Fonction pour exécuter une requête
-@st.cache_data(ttl=600)
-def run_query(_conn, query):
-    """Exécute une requête et retourne un DataFrame"""
-    try:
-        cursor = _conn.cursor()
-        cursor.execute(query)
-        df = cursor.fetch_pandas_all()
-        cursor.close()
-        return df
-    except Exception as e:
-        st.error(f"Erreur lors de l'exécution de la requête: {e}")
-        return pd.DataFrame()
-
 # Fonction pour obtenir les statistiques par zones
-@st.cache_data(ttl=3600)
 def get_zones_stats(_conn):
     """Récupère les statistiques par zones basées sur les prix moyens"""
-    query = """
-    SELECT 
-        CASE 
-            WHEN AVG_PRICE_BY_POSTAL < 200000 THEN 'Zone Économique'
-            WHEN AVG_PRICE_BY_POSTAL < 300000 THEN 'Zone Modérée'
-            WHEN AVG_PRICE_BY_POSTAL < 400000 THEN 'Zone Premium'
-            ELSE 'Zone Luxe'
-        END as ZONE_TYPE,
-        AVG(AVG_PRICE_BY_POSTAL) as AVG_PRICE_BY_POSTAL,
-        AVG(AVG_PRICE_PER_SQM_BY_POSTAL) as AVG_PRICE_PER_SQM_BY_POSTAL,
-        AVG(DISTANCE_TO_CENTER_KM) as AVG_DISTANCE,
-        COUNT(*) as NB_TRANSACTIONS
-    FROM PREDICTION_PRIX 
-    WHERE VALEUR_FONCIERE > 0 AND SURFACE_REELLE_BATI > 0
-    GROUP BY ZONE_TYPE
-    HAVING COUNT(*) >= 50
-    ORDER BY AVG_PRICE_BY_POSTAL
-    """
-    return run_query(_conn, query)
+    return run_query(_conn, *requete_zones_stats())
 
 # Interface principale
 def main():
@@ -77,6 +29,9 @@ def main():
         st.warning("⚠️ Impossible de se connecter à Snowflake. Veuillez vérifier votre configuration.")
         return
 
+    # Préchauffage du cache (une fois par processus, en arrière-plan)
+    demarrer_prechauffage()
+
     # Charger les statistiques des zones
     zones_stats = get_zones_stats(conn)
     if zones_stats.empty:
@@ -151,67 +106,92 @@ def main():
                 prix_min = prix_estime * 0.85
                 prix_max = prix_estime * 1.15
                 
-                similar_query = f"""
+                similar_query = """
                 SELECT 
                     SURFACE_REELLE_BATI as "Surface (m²)",
                     NOMBRE_PIECES_PRINCIPALES as "Pièces",
                     VALEUR_FONCIERE as "Prix vendu (€)",
                     ROUND(VALEUR_FONCIERE / SURFACE_REELLE_BATI, 0) as "Prix/m² (€)",
-                    ABS(VALEUR_FONCIERE - {prix_estime}) as "Écart prix (€)",
+                    ABS(VALEUR_FONCIERE - ?) as "Écart prix (€)",
                     DISTANCE_TO_CENTER_KM as "Distance centre (km)"
                 FROM PREDICTION_PRIX
-                WHERE SURFACE_REELLE_BATI BETWEEN {surface_min} AND {surface_max}
-                  AND NOMBRE_PIECES_PRINCIPALES = {pieces}
-                  AND VALEUR_FONCIERE BETWEEN {prix_min} AND {prix_max}
+                WHERE SURFACE_REELLE_BATI BETWEEN ? AND ?
+                  AND NOMBRE_PIECES_PRINCIPALES = ?
+                  AND VALEUR_FONCIERE BETWEEN ? AND ?
                   AND VALEUR_FONCIERE IS NOT NULL
-                ORDER BY ABS(VALEUR_FONCIERE - {prix_estime})
+                ORDER BY ABS(VALEUR_FONCIERE - ?)
                 LIMIT 10
                 """
                 
-                similar_df = run_query(conn, similar_query)
-                
-                if not similar_df.empty:
-                    # Formater l'affichage
-                    similar_df_display = similar_df.copy()
-                    for col in ["Prix vendu (€)", "Prix/m² (€)", "Écart prix (€)"]:
-                        if col in similar_df_display.columns:
-                            similar_df_display[col] = similar_df_display[col].apply(lambda x: f"{x:,.0f}")
-                    
-                    st.dataframe(similar_df_display, use_container_width=True, hide_index=True)
-                    
-                    # Statistiques des appartements similaires
-                    prix_moyen_similaires = similar_df["Prix vendu (€)"].mean()
-                    ecart_prediction = abs(prix_moyen_similaires - prix_estime)
-                    precision = (1 - ecart_prediction / prix_moyen_similaires) * 100
-                    
-                    st.success(f"📈 Analyse basée sur **{len(similar_df)}** transactions similaires")
-                    st.info(f"🎯 Précision de l'estimation: **{precision:.1f}%** (écart moyen: {ecart_prediction:,.0f} €)")
-                    
-                else:
-                    st.warning("⚠️ Aucun appartement similaire trouvé avec ces critères")
-                    
-                    # Suggestions alternatives
-                    st.markdown("### 💡 Suggestions")
-                    suggestion_query = f"""
-                    SELECT 
-                        NOMBRE_PIECES_PRINCIPALES as "Pièces",
-                        COUNT(*) as "Nb transactions",
-                        AVG(VALEUR_FONCIERE) as "Prix moyen",
-                        AVG(SURFACE_REELLE_BATI) as "Surface moyenne"
-                    FROM PREDICTION_PRIX
-                    WHERE SURFACE_REELLE_BATI BETWEEN {surface-20} AND {surface+20}
-                      AND VALEUR_FONCIERE > 0
-                    GROUP BY NOMBRE_PIECES_PRINCIPALES
-                    ORDER BY COUNT(*) DESC
-                    LIMIT 5
-                    """
-                    
-                    suggestion_df = run_query(conn, suggestion_query)
-                    if not suggestion_df.empty:
-                        suggestion_df["Prix moyen"] = suggestion_df["Prix moyen"].apply(lambda x: f"{x:,.0f} €")
-                        suggestion_df["Surface moyenne"] = suggestion_df["Surface moyenne"].apply(lambda x: f"{x:.0f} m²")
-                        st.dataframe(suggestion_df, use_container_width=True, hide_index=True)
-                        
+                suggestion_query = """
+                SELECT 
+                    NOMBRE_PIECES_PRINCIPALES as "Pièces",
+                    COUNT(*) as "Nb transactions",
+                    AVG(VALEUR_FONCIERE) as "Prix moyen",
+                    AVG(SURFACE_REELLE_BATI) as "Surface moyenne"
+                FROM PREDICTION_PRIX
+                WHERE SURFACE_REELLE_BATI BETWEEN ? AND ?
+                  AND VALEUR_FONCIERE > 0
+                GROUP BY NOMBRE_PIECES_PRINCIPALES
+                ORDER BY COUNT(*) DESC
+                LIMIT 5
+                """
+
+                # Les deux requêtes sont soumises ensemble ; les suggestions ne servent que
+                # si aucun appartement similaire n'est trouvé (sinon elles sont annulées).
+                # closing : requêtes en cours annulées et connexion rendue, même sur exception
+                with closing(run_queries(conn, {
+                    "similaires": (similar_query, [
+                        prix_estime, surface_min, surface_max, pieces, prix_min, prix_max, prix_estime
+                    ]),
+                    "suggestions": (suggestion_query, [surface - 20, surface + 20]),
+                })) as flux:
+                    resultats = {}
+                    for nom, df_resultat in flux:
+                        resultats[nom] = df_resultat
+
+                        if nom == "similaires" and not df_resultat.empty:
+                            similar_df = df_resultat
+
+                            # Formater l'affichage
+                            st.dataframe(
+                                similar_df,
+                                use_container_width=True,
+                                hide_index=True,
+                                column_config={
+                                    col: st.column_config.NumberColumn(format="%.0f")
+                                    for col in ["Prix vendu (€)", "Prix/m² (€)", "Écart prix (€)"]
+                                }
+                            )
+
+                            # Statistiques des appartements similaires
+                            prix_moyen_similaires = similar_df["Prix vendu (€)"].mean()
+                            ecart_prediction = abs(prix_moyen_similaires - prix_estime)
+                            precision = (1 - ecart_prediction / prix_moyen_similaires) * 100
+
+                            st.success(f"📈 Analyse basée sur **{len(similar_df)}** transactions similaires")
+                            st.info(f"🎯 Précision de l'estimation: **{precision:.1f}%** (écart moyen: {ecart_prediction:,.0f} €)")
+                            break
+
+                        if nom == "similaires":
+                            st.warning("⚠️ Aucun appartement similaire trouvé avec ces critères")
+
+                            # Suggestions alternatives
+                            st.markdown("### 💡 Suggestions")
+
+                        if "similaires" in resultats and "suggestions" in resultats:
+                            suggestion_df = resultats["suggestions"]
+                            if not suggestion_df.empty:
+                                st.dataframe(
+                                    suggestion_df,
+                                    use_container_width=True,
+                                    hide_index=True,
+                                    column_config={
+                                        "Prix moyen": st.column_config.NumberColumn(format="%.0f €"),
+                                        "Surface moyenne": st.column_config.NumberColumn(format="%.0f m²"),
+                                    }
+                                )
+
             except Exception as e:
                 st.error(f"❌ Erreur lors de la prédiction : {e}")
 
@@ -220,4 +200,5 @@ def main():
     st.markdown("*Application basée sur les données DVF (Demandes de Valeurs Foncières)*")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+    afficher_profil_requetes()
\ No newline at end of file
@@ -0,0 +1,283 @@
+"""
+Requêtes SQL partagées par les pages et le préchauffage du cache (warmup.py)
+
+Chaque fonction requete_* retourne (sql, params) : les pages et le préchauffage
+construisent ainsi exactement le même texte et les mêmes paramètres, donc la même clé
+de cache.
+"""
+from datetime import timedelta
+
+from db import filtres_sql, executer_cache
+
+# Sketch de quantiles : histogramme à buckets logarithmiques [GAMMA^b, GAMMA^(b+1)),
+# médiane estimée à ALPHA près en valeur relative (principe de DDSketch)
+ALPHA = 0.01
+GAMMA = (1 + ALPHA) / (1 - ALPHA)
+
+# Aperçu : part (en %) des micro-partitions de FACT_MUTATION lues (SAMPLE SYSTEM), pour la
+# vue nationale et pour un département (plus rare dans chaque bloc échantillonné)
+POURCENTAGE_APERCU = 1
+POURCENTAGE_APERCU_DEPARTEMENT = 10
+
+# Agrégat mensuel construit par agregats.py : une ligne par mois × commune × code postal ×
+# type de bien × mesure, avec NB, SOMME, MINI, MAXI et l'histogramme SKETCH (bucket → nombre,
+# mêmes buckets que le cube)
+TABLE_AGREGAT = "VALFONC_ANALYTICS.GOLD.AGG_MUTATION_MONTHLY"
+# Filigrane CREATED_AT des lignes de faits prises en compte par l'agrégat
+TABLE_AGREGAT_ETAT = "VALFONC_ANALYTICS.GOLD.AGG_MUTATION_MONTHLY_ETAT"
+
+def requete_hierarchie_geographique():
+    """Départements, codes postaux et communes présents dans les mutations"""
+    query = """
+    SELECT DISTINCT c.CODE_DEPARTEMENT, p.CODE_POSTAL, c.COMMUNE
+    FROM VALFONC_ANALYTICS.GOLD.FACT_MUTATION m
+    INNER JOIN VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c ON m.COMMUNE_ID = c.COMMUNE_ID
+    LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_CODE_POSTAL p ON m.CODE_POSTAL_ID = p.CODE_POSTAL_ID
+    """
+    return query, []
+
+def requete_cube_mensuel(commune=None, departement=None, start_date=None, end_date=None):
+    """
+    Cube mois × type de bien × mesure (PRIX, SURFACE) × bucket, et ses totaux exacts
+
+    Voir get_cube_mensuel (page Analyse Temporelle) pour la lecture du résultat.
+    """
+    filtres, params = filtres_sql(
+        ("c.COMMUNE = ?", commune),
+        ("c.CODE_DEPARTEMENT = ?", departement),
+        ("f.DATE_MUTATION >= ?", start_date),
+        ("f.DATE_MUTATION <= ?", end_date),
+    )
+
+    query = f"""
+    WITH base AS (
+        SELECT
+            DATE_TRUNC('month', f.DATE_MUTATION) as MOIS,
+            t.TYPE_LOCAL,
+            f.VALEUR_FONCIERE,
+            f.SURFACE_REELLE_BATI
+        FROM VALFONC_ANALYTICS.GOLD.FACT_MUTATION f
+        LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c ON f.COMMUNE_ID = c.COMMUNE_ID
+        LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_TYPE_LOCAL t ON f.TYPE_LOCAL_ID = t.TYPE_LOCAL_ID
+        WHERE 1=1
+            AND f.VALEUR_FONCIERE > 0
+            AND f.DATE_MUTATION IS NOT NULL
+            {filtres}
+    ),
+    mesures AS (
+        SELECT
+            b.MOIS,
+            b.TYPE_LOCAL,
+            m.MESURE,
+            CASE WHEN m.MESURE = 'PRIX' THEN b.VALEUR_FONCIERE ELSE b.SURFACE_REELLE_BATI END as VALEUR
+        FROM base b
+        CROSS JOIN (SELECT 'PRIX' as MESURE UNION ALL SELECT 'SURFACE') m
+    )
+    SELECT
+        MOIS,
+        TYPE_LOCAL,
+        MESURE,
+        FLOOR(LN(VALEUR) / LN({GAMMA})) as BUCKET,
+        COUNT(*) as NB,
+        SUM(VALEUR) as SOMME,
+        MIN(VALEUR) as MINI,
+        MAX(VALEUR) as MAXI,
+        CASE WHEN GROUPING(MOIS) = 1 THEN MEDIAN(VALEUR) END as MEDIANE,
+        GROUPING(MOIS, TYPE_LOCAL) as NIVEAU
+    FROM mesures
+    WHERE VALEUR > 0
+    GROUP BY GROUPING SETS (
+        (MOIS, TYPE_LOCAL, MESURE, BUCKET),
+        (TYPE_LOCAL, MESURE),
+        (MESURE)
+    )
+    """
+    return query, params
+
+def requete_cube_agrege(commune=None, departement=None, start_date=None, end_date=None):
+    """
+    Même résultat que requete_cube_mensuel, lu dans AGG_MUTATION_MONTHLY
+
+    Les cellules retenues par les filtres sont dépliées en une ligne par bucket de leur
+    SKETCH, puis fusionnées comme le cube : la requête ne lit pas la table de faits. Par
+    bucket, SOMME est la part de la somme de la cellule au prorata de NB, et [MINI, MAXI]
+    les bornes du bucket, ramenées au minimum / maximum de la cellule dans ses buckets
+    extrêmes : les totaux par mois et par type de bien (nombre, somme, minimum, maximum)
+    sont exacts. Les dates doivent couvrir des mois entiers (MOIS est le premier jour du
+    mois). MEDIANE est NULL : l'agrégat ne conserve que l'histogramme.
+    """
+    filtres, params = filtres_sql(
+        ("c.COMMUNE = ?", commune),
+        ("c.CODE_DEPARTEMENT = ?", departement),
+        ("a.MOIS >= ?", start_date),
+        ("a.MOIS <= ?", end_date),
+    )
+
+    query = f"""
+    WITH cellules AS (
+        SELECT a.MOIS, t.TYPE_LOCAL, a.MESURE, a.NB, a.SOMME, a.MINI, a.MAXI, a.SKETCH
+        FROM {TABLE_AGREGAT} a
+        LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c ON a.COMMUNE_ID = c.COMMUNE_ID
+        LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_TYPE_LOCAL t ON a.TYPE_LOCAL_ID = t.TYPE_LOCAL_ID
+        WHERE 1=1
+            {filtres}
+    ),
+    buckets AS (
+        SELECT
+            a.MOIS,
+            a.TYPE_LOCAL,
+            a.MESURE,
+            s.KEY::NUMBER as BUCKET,
+            s.VALUE::NUMBER as NB,
+            a.SOMME * s.VALUE::NUMBER / a.NB as SOMME,
+            CASE WHEN s.KEY::NUMBER = FLOOR(LN(a.MINI) / LN({GAMMA})) THEN a.MINI
+                 ELSE POWER({GAMMA}, s.KEY::NUMBER) END as MINI,
+            CASE WHEN s.KEY::NUMBER = FLOOR(LN(a.MAXI) / LN({GAMMA})) THEN a.MAXI
+                 ELSE POWER({GAMMA}, s.KEY::NUMBER + 1) END as MAXI
+        FROM cellules a, LATERAL FLATTEN(input => a.SKETCH) s
+    )
+    SELECT
+        MOIS,
+        TYPE_LOCAL,
+        MESURE,
+        BUCKET,
+        SUM(NB) as NB,
+        SUM(SOMME) as SOMME,
+        MIN(MINI) as MINI,
+        MAX(MAXI) as MAXI,
+        CAST(NULL AS FLOAT) as MEDIANE,
+        GROUPING(MOIS, TYPE_LOCAL) as NIVEAU
+    FROM buckets
+    GROUP BY GROUPING SETS (
+        (MOIS, TYPE_LOCAL, MESURE, BUCKET),
+        (TYPE_LOCAL, MESURE),
+        (MESURE)
+    )
+    """
+    return query, params
+
+def requete_cube_echantillon(commune=None, departement=None, start_date=None, end_date=None,
+                             pourcentage=POURCENTAGE_APERCU):
+    """
+    Aperçu de requete_cube_mensuel calculé sur un échantillon de blocs de FACT_MUTATION
+
+    SAMPLE SYSTEM lit `pourcentage` % des micro-partitions : la requête ne coûte qu'une
+    fraction du cube exact. NB et SOMME sont extrapolés (÷ pourcentage) ; moyennes et
+    quantiles de l'histogramme sont inchangés par cette mise à l'échelle. MEDIANE vient de
+    APPROX_PERCENTILE. MINI et MAXI sont ceux de l'échantillon.
+    """
+    filtres, params = filtres_sql(
+        ("c.COMMUNE = ?", commune),
+        ("c.CODE_DEPARTEMENT = ?", departement),
+        ("f.DATE_MUTATION >= ?", start_date),
+        ("f.DATE_MUTATION <= ?", end_date),
+    )
+    facteur = 100 / pourcentage
+
+    query = f"""
+    WITH base AS (
+        SELECT
+            DATE_TRUNC('month', f.DATE_MUTATION) as MOIS,
+            t.TYPE_LOCAL,
+            f.VALEUR_FONCIERE,
+            f.SURFACE_REELLE_BATI
+        FROM VALFONC_ANALYTICS.GOLD.FACT_MUTATION f SAMPLE SYSTEM ({pourcentage})
+        LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_COMMUNE c ON f.COMMUNE_ID = c.COMMUNE_ID
+        LEFT JOIN VALFONC_ANALYTICS.GOLD.DIM_TYPE_LOCAL t ON f.TYPE_LOCAL_ID = t.TYPE_LOCAL_ID
+        WHERE 1=1
+            AND f.VALEUR_FONCIERE > 0
+            AND f.DATE_MUTATION IS NOT NULL
+            {filtres}
+    ),
+    mesures AS (
+        SELECT
+            b.MOIS,
+            b.TYPE_LOCAL,
+            m.MESURE,
+            CASE WHEN m.MESURE = 'PRIX' THEN b.VALEUR_FONCIERE ELSE b.SURFACE_REELLE_BATI END as VALEUR
+        FROM base b
+        CROSS JOIN (SELECT 'PRIX' as MESURE UNION ALL SELECT 'SURFACE') m
+    )
+    SELECT
+        MOIS,
+        TYPE_LOCAL,
+        MESURE,
+        FLOOR(LN(VALEUR) / LN({GAMMA})) as BUCKET,
+        ROUND(COUNT(*) * {facteur}) as NB,
+        SUM(VALEUR) * {facteur} as SOMME,
+        MIN(VALEUR) as MINI,
+        MAX(VALEUR) as MAXI,
+        CASE WHEN GROUPING(MOIS) = 1 THEN APPROX_PERCENTILE(VALEUR, 0.5) END as MEDIANE,
+        GROUPING(MOIS, TYPE_LOCAL) as NIVEAU
+    FROM mesures
+    WHERE VALEUR > 0
+    GROUP BY GROUPING SETS (
+        (MOIS, TYPE_LOCAL, MESURE, BUCKET),
+        (TYPE_LOCAL, MESURE),
+        (MESURE)
+    )
+    """
+    return query, params
+
+def requete_agregat_present():
+    """Nombre de tables d'état de l'agrégat (0 si agregats.py n'a jamais été exécuté)"""
+    query = """
+    SELECT COUNT(*) as N
+    FROM VALFONC_ANALYTICS.INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_SCHEMA = 'GOLD' AND TABLE_NAME = 'AGG_MUTATION_MONTHLY_ETAT'
+    """
+    return query, []
+
+def requete_agregat_a_jour():
+    """Vrai si le filigrane de l'agrégat couvre la dernière ligne créée dans FACT_MUTATION"""
+    query = f"""
+    SELECT COALESCE(
+        (SELECT MAX(FILIGRANE) FROM {TABLE_AGREGAT_ETAT})
+            >= (SELECT MAX(CREATED_AT) FROM VALFONC_ANALYTICS.GOLD.FACT_MUTATION),
+        FALSE
+    ) as A_JOUR
+    """
+    return query, []
+
+def agregat_a_jour(conn):
+    """
+    Vrai si AGG_MUTATION_MONTHLY existe et a été rafraîchi depuis le dernier chargement
+
+    Les deux sondes passent par le cache de résultats : elles sont réévaluées à chaque
+    changement de version des données. Toute erreur (source locale, droits) vaut Faux.
+    """
+    try:
+        if executer_cache(conn, *requete_agregat_present()).column(0)[0].as_py() == 0:
+            return False
+        return bool(executer_cache(conn, *requete_agregat_a_jour()).column(0)[0].as_py())
+    except Exception:
+        return False
+
+def mois_entiers(start_date=None, end_date=None):
+    """Vrai si la plage de dates commence un 1er et finit un dernier jour de mois (bornes absentes comprises)"""
+    return (
+        (start_date is None or start_date.day == 1)
+        and (end_date is None or (end_date + timedelta(days=1)).day == 1)
+    )
+
+def requete_zones_stats():
+    """Statistiques par zone de prix (page Prédiction Prix)"""
+    query = """
+    SELECT
+        CASE
+            WHEN AVG_PRICE_BY_POSTAL < 200000 THEN 'Zone Économique'
+            WHEN AVG_PRICE_BY_POSTAL < 300000 THEN 'Zone Modérée'
+            WHEN AVG_PRICE_BY_POSTAL < 400000 THEN 'Zone Premium'
+            ELSE 'Zone Luxe'
+        END as ZONE_TYPE,
+        AVG(AVG_PRICE_BY_POSTAL) as AVG_PRICE_BY_POSTAL,
+        AVG(AVG_PRICE_PER_SQM_BY_POSTAL) as AVG_PRICE_PER_SQM_BY_POSTAL,
+        AVG(DISTANCE_TO_CENTER_KM) as AVG_DISTANCE,
+        COUNT(*) as NB_TRANSACTIONS
+    FROM PREDICTION_PRIX
+    WHERE VALEUR_FONCIERE > 0 AND SURFACE_REELLE_BATI > 0
+    GROUP BY ZONE_TYPE
+    HAVING COUNT(*) >= 50
+    ORDER BY AVG_PRICE_BY_POSTAL
+    """
+    return query, []
@@ -0,0 +1,136 @@
+"""
+Source de données locale : la couche gold lue depuis un instantané Parquet par DuckDB
+
+L'instantané contient un dossier par table (FACT_MUTATION/, DIM_COMMUNE/, ...), en
+fichiers Parquet éventuellement partitionnés à la Hive (CODE_DEPARTEMENT=35/ANNEE=2024/).
+Une base DuckDB en mémoire attache un catalogue VALFONC_ANALYTICS avec un schéma GOLD
+dont chaque table est une vue read_parquet : les requêtes des pages, qualifiées
+(VALFONC_ANALYTICS.GOLD.FACT_MUTATION) ou non (PREDICTION_PRIX), s'exécutent sans
+modification, avec leurs paramètres liés au format ?.
+
+SourceLocale expose la même interface que db.PoolConnexions (connexion(), emprunter(),
+rendre()), et ses connexions le sous-ensemble de l'API du connecteur Snowflake utilisé
+par db.py : cursor(), execute(sql, params), fetch_arrow_all(), description, sfqid.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import duckdb
+
+DOSSIER_INSTANTANE = "instantane"
+TABLES = ["FACT_MUTATION", "DIM_COMMUNE", "DIM_TYPE_LOCAL", "DIM_CODE_POSTAL", "PREDICTION_PRIX"]
+
+def cles_partition(chemin):
+    """Clés des sous-dossiers Hive (cle=valeur) d'une table de l'instantané, dans l'ordre rencontré"""
+    cles = []
+    for _, dossiers, _ in os.walk(chemin):
+        for nom in dossiers:
+            cle = nom.split("=", 1)[0]
+            if "=" in nom and cle not in cles:
+                cles.append(cle)
+    return cles
+
+class CurseurLocal:
+    """Curseur DuckDB présenté comme un curseur Snowflake"""
+
+    sfqid = None
+
+    def __init__(self, connexion):
+        self.curseur = connexion
+
+    @property
+    def description(self):
+        return self.curseur.description
+
+    def execute(self, sql, params=None):
+        self.curseur.execute(sql, params)
+        return self
+
+    def fetch_arrow_all(self):
+        # to_arrow_table() remplace fetch_arrow_table() depuis DuckDB 1.4
+        if hasattr(self.curseur, "to_arrow_table"):
+            return self.curseur.to_arrow_table()
+        return self.curseur.fetch_arrow_table()
+
+    def fetchall(self):
+        return self.curseur.fetchall()
+
+    def fetchone(self):
+        return self.curseur.fetchone()
+
+    def close(self):
+        pass
+
+class ConnexionLocale:
+    """Connexion DuckDB (une par emprunt, même base en mémoire), schéma courant VALFONC_ANALYTICS.GOLD"""
+
+    def __init__(self, base):
+        self.duckdb = base.cursor()
+        self.duckdb.execute("USE VALFONC_ANALYTICS.GOLD")
+
+    def cursor(self):
+        return CurseurLocal(self.duckdb)
+
+    def is_closed(self):
+        return False
+
+    def close(self):
+        self.duckdb.close()
+
+class SourceLocale:
+    """
+    Base DuckDB en mémoire sur un instantané Parquet de la couche gold
+
+    Chaque emprunt ouvre une connexion DuckDB sur la base partagée : les sessions
+    Streamlit exécutent leurs requêtes en parallèle. Les tables absentes de l'instantané
+    ne sont pas créées (les requêtes qui les lisent échouent comme sur une table inconnue).
+    """
+
+    def __init__(self, dossier=DOSSIER_INSTANTANE, tables=TABLES):
+        if not os.path.isdir(dossier):
+            raise FileNotFoundError(f"Instantané Parquet introuvable : {dossier}")
+        self.dossier = dossier
+        self.verrou = threading.Lock()
+        self.base = duckdb.connect()
+        self.base.execute("ATTACH ':memory:' AS VALFONC_ANALYTICS")
+        self.base.execute("CREATE SCHEMA VALFONC_ANALYTICS.GOLD")
+        self.tables = []
+        for table in tables:
+            chemin = os.path.join(dossier, table)
+            if not os.path.isdir(chemin):
+                continue
+            motif = os.path.join(chemin, "**", "*.parquet").replace("'", "''")
+            # Les clés de partition (CODE_DEPARTEMENT, ANNEE de FACT_MUTATION) ne sont pas des
+            # colonnes de la table Snowflake : SELECT * y rend les mêmes colonnes
+            cles = cles_partition(chemin)
+            exclues = f" EXCLUDE ({', '.join(cles)})" if cles else ""
+            self.base.execute(f"""
+                CREATE VIEW VALFONC_ANALYTICS.GOLD.{table} AS
+                SELECT *{exclues} FROM read_parquet('{motif}', hive_partitioning = true, union_by_name = true)
+            """)
+            self.tables.append(table)
+
+    def emprunter(self):
+        with self.verrou:
+            return ConnexionLocale(self.base)
+
+    def rendre(self, conn):
+        conn.close()
+
+    @contextmanager
+    def connexion(self):
+        conn = self.emprunter()
+        try:
+            yield conn
+        finally:
+            self.rendre(conn)
+
+    def version(self):
+        """Version des données : date de modification la plus récente des fichiers de l'instantané"""
+        mtime = 0.0
+        for racine, _, noms in os.walk(self.dossier):
+            for nom in noms:
+                if nom.endswith(".parquet"):
+                    mtime = max(mtime, os.path.getmtime(os.path.join(racine, nom)))
+        return str(mtime) if mtime else None
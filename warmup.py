@@ -0,0 +1,89 @@
+"""
+Préchauffage du cache de résultats
+
+Un thread d'arrière-plan, démarré une fois par processus (st.cache_resource), calcule au
+démarrage puis à intervalle régulier les requêtes les plus demandées : hiérarchie
+géographique, cube mensuel national et des départements configurés, statistiques par
+zone. Les pages trouvent ainsi ces résultats dans le cache dès la première visite.
+
+Les résultats déjà en cache pour la version courante des données ne sont pas recalculés :
+un passage ne coûte des requêtes qu'après un chargement de la couche gold ou l'expiration
+d'une entrée.
+
+Configuration (section [prechauffage] de secrets.toml) :
+    actif = true
+    departements = ["75", "13", "69"]   # en plus de la vue nationale
+    intervalle = 900                    # secondes entre deux passages
+"""
+import threading
+import traceback
+
+import streamlit as st
+
+from db import get_snowflake_connection, executer_cache
+from requetes import (
+    agregat_a_jour, requete_cube_agrege, requete_cube_mensuel, requete_hierarchie_geographique,
+    requete_zones_stats,
+)
+
+DEPARTEMENTS = ["75", "13", "69", "59", "33"]
+INTERVALLE = 900
+
+def requetes_a_prechauffer(departements, agregat=False):
+    """
+    (nom, (sql, params)) des requêtes à garder en cache
+
+    Le cube mensuel couvre toutes les granularités et tous les types de bien : seules
+    la portée géographique (nationale puis par département) et les dates par défaut des
+    filtres (aucune) définissent une combinaison.
+    """
+    yield "hierarchie", requete_hierarchie_geographique()
+    yield "zones", requete_zones_stats()
+    # Même choix que la page : l'agrégat mensuel s'il est à jour, la table de faits sinon
+    requete_cube = requete_cube_agrege if agregat else requete_cube_mensuel
+    yield "cube national", requete_cube()
+    for departement in departements:
+        yield f"cube {departement}", requete_cube(departement=departement)
+
+def prechauffer(conn, departements=DEPARTEMENTS):
+    """Met en cache chaque requête ; une erreur n'interrompt pas les suivantes. Retourne les noms en échec."""
+    echecs = []
+    for nom, (sql, params) in requetes_a_prechauffer(departements, agregat_a_jour(conn)):
+        try:
+            executer_cache(conn, sql, params)
+        except Exception:
+            traceback.print_exc()
+            echecs.append(nom)
+    return echecs
+
+class Prechauffage(threading.Thread):
+    """Thread démon qui relance prechauffer toutes les `intervalle` secondes"""
+
+    def __init__(self, departements=DEPARTEMENTS, intervalle=INTERVALLE):
+        super().__init__(name="prechauffage-cache", daemon=True)
+        self.departements = departements
+        self.intervalle = intervalle
+        self.arret = threading.Event()
+
+    def run(self):
+        while not self.arret.is_set():
+            conn = get_snowflake_connection()
+            if conn is not None:
+                prechauffer(conn, self.departements)
+            self.arret.wait(self.intervalle)
+
+    def arreter(self):
+        self.arret.set()
+
+@st.cache_resource
+def demarrer_prechauffage():
+    """Démarre le préchauffage (une seule fois par processus) ; None s'il est désactivé"""
+    config = st.secrets.get("prechauffage", {})
+    if not config.get("actif", True):
+        return None
+    thread = Prechauffage(
+        list(config.get("departements", DEPARTEMENTS)),
+        config.get("intervalle", INTERVALLE),
+    )
+    thread.start()
+    return thread